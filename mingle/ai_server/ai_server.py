@@ -11,7 +11,7 @@ Start:
 import os
 import sys
 import json
-import threading
+import asyncio
 
 # main.py is in the same directory; add it to path
 _HERE = os.path.dirname(os.path.abspath(__file__))
@@ -19,29 +19,59 @@ sys.path.insert(0, _HERE)
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from main import generate_hybrid  # noqa: E402  (added after sys.path manipulation)
+from main import LOCAL_BACKEND, generate_hybrid_async, ModelPool, cache_stats, pool_stats, tool_registry_stats  # noqa: E402  (added after sys.path manipulation)
+from prescore import prescore, reason as prescore_reason  # noqa: E402
+from profile_index import BackgroundIndexer, ProfileIndex, hashed_embedding  # noqa: E402
+from rank_cache import RankCache, content_version, normalize_query  # noqa: E402
 
 try:
-    from cactus import cactus_init, cactus_destroy
-    try:
-        from cactus import cactus_rag_query
-        _HAS_RAG = True
-    except ImportError:
-        _HAS_RAG = False
+    if LOCAL_BACKEND == "sim":
+        from sim_backends import cactus_init, cactus_destroy
+        _HAS_EMBED = False
+    else:
+        from cactus import cactus_init, cactus_destroy
+        try:
+            from cactus import cactus_embed
+            _HAS_EMBED = True
+        except ImportError:
+            _HAS_EMBED = False
     _HAS_CACTUS = True
 except ImportError:
     _HAS_CACTUS = False
-    _HAS_RAG = False
+    _HAS_EMBED = False
 
 # ---------------------------------------------------------------------------
 # Globals
 # ---------------------------------------------------------------------------
 RAG_CORPUS_DIR = os.path.join(os.path.dirname(__file__), "rag_corpus")
-_rag_model = None
-_rag_lock = threading.Lock()
+# cactus_embed handles: queries and the background indexer get separate pools,
+# so a reindex never holds a handle a query is waiting on
+RAG_QUERY_POOL_SIZE = int(os.environ.get("RAG_QUERY_POOL_SIZE", 4))
+RAG_INDEX_POOL_SIZE = int(os.environ.get("RAG_INDEX_POOL_SIZE", 1))
+# Profile syncs are coalesced over this window before the index is rebuilt
+RAG_DEBOUNCE_MS = int(os.environ.get("RAG_DEBOUNCE_MS", 500))
+RAG_MAX_DELAY_MS = int(os.environ.get("RAG_MAX_DELAY_MS", 5000))
+# Memory-mapped index snapshots, so a restart does not re-embed the corpus
+RAG_INDEX_DIR = os.environ.get("RAG_INDEX_DIR", os.path.join(RAG_CORPUS_DIR, "index"))
+RAG_PERSIST_INTERVAL_S = float(os.environ.get("RAG_PERSIST_INTERVAL_S", 30))
+# Share of the dense (embedding) score in hybrid retrieval; 0 = BM25 only
+RAG_VECTOR_WEIGHT = float(os.environ.get("RAG_VECTOR_WEIGHT", 0.5))
+_query_embed_pool = None  # ModelPools of plain handles for cactus_embed, when available
+_index_embed_pool = None
+
+# /ai/rank-contacts fan-out limits (per request; callers may ask for less)
+RANK_MAX_CONCURRENCY = int(os.environ.get("RANK_MAX_CONCURRENCY", 8))
+RANK_DEADLINE_MS = int(os.environ.get("RANK_DEADLINE_MS", 20000))
+# Contacts are pre-scored on their structured fields; only this many of the
+# best go to the model for a score, reason and outreach angle
+RANK_LLM_SHORTLIST = int(os.environ.get("RANK_LLM_SHORTLIST", 5))
+# rank_contact results per (query, profile, content version); "" disables persistence
+RANK_CACHE_MAX_MB = float(os.environ.get("RANK_CACHE_MAX_MB", 16))
+RANK_CACHE_PATH = os.environ.get("RANK_CACHE_PATH", os.path.join(RAG_INDEX_DIR, "rank_cache.json"))
 
 functiongemma_path = os.path.join(_HERE, "../../cactus/weights/functiongemma-270m-it")
 
@@ -56,43 +86,71 @@ app.add_middleware(
 
 
 # ---------------------------------------------------------------------------
-# RAG model helpers
+# RAG index helpers
 # ---------------------------------------------------------------------------
 
-def _load_rag_model():
-    global _rag_model
-    if not _HAS_CACTUS:
-        return
-    with _rag_lock:
-        if _rag_model is not None:
-            try:
-                cactus_destroy(_rag_model)
-            except Exception:
-                pass
-        try:
-            _rag_model = cactus_init(functiongemma_path, corpus_dir=RAG_CORPUS_DIR)
-        except Exception:
-            _rag_model = None
+def _embed(pool, text: str):
+    """Embed with Cactus on ``pool`` when available, else hashed features."""
+    if pool is None:
+        return hashed_embedding(text)
+    with pool.borrow() as model:
+        return cactus_embed(model, text, normalize=True)
+
+
+# Syncs queue on the background indexer, which embeds coalesced batches and
+# swaps in a new snapshot; queries always read the last published snapshot
+# and take no lock.
+_profile_index = ProfileIndex(
+    lambda text: _embed(_index_embed_pool, text),
+    query_embed=lambda text: _embed(_query_embed_pool, text),
+    vector_weight=RAG_VECTOR_WEIGHT,
+    persist_dir=RAG_INDEX_DIR,
+)
+_indexer = BackgroundIndexer(
+    _profile_index, RAG_DEBOUNCE_MS / 1000, RAG_MAX_DELAY_MS / 1000, persist_interval_s=RAG_PERSIST_INTERVAL_S,
+)
 
 
-def _rag_query_profiles(query: str, top_k: int = 8) -> List[str]:
-    """Return profile IDs from RAG retrieval (best-effort)."""
-    if not _HAS_RAG or _rag_model is None:
-        return []
+def _new_embed_pool(size: int):
+    pool = ModelPool(lambda: cactus_init(functiongemma_path), size=size, destroy=cactus_destroy)
     try:
-        with _rag_lock:
-            chunks = cactus_rag_query(_rag_model, query, top_k=top_k)
-        profile_ids = []
-        seen = set()
-        for chunk in chunks:
-            src = chunk.get("source", "")
-            pid = os.path.splitext(os.path.basename(src))[0]
-            if pid and pid not in seen:
-                seen.add(pid)
-                profile_ids.append(pid)
-        return profile_ids
+        pool.warm(1)
+        return pool
     except Exception:
-        return []
+        pool.close()
+        return None
+
+
+def _load_profile_index():
+    """Start the embedding pools and load the index (startup only).
+
+    Maps the last saved snapshot and catches up on profiles synced since;
+    without a usable snapshot the whole corpus is indexed and saved.
+    """
+    global _query_embed_pool, _index_embed_pool
+    if _HAS_CACTUS and _HAS_EMBED:
+        _index_embed_pool = _new_embed_pool(RAG_INDEX_POOL_SIZE)
+        _query_embed_pool = _new_embed_pool(RAG_QUERY_POOL_SIZE) if _index_embed_pool is not None else None
+        if _query_embed_pool is None:
+            _index_embed_pool = None    # both or neither: the two must share an embedding space
+    _profile_index.embedder_name = "cactus" if _index_embed_pool is not None else "hashed"
+    if _profile_index.open():
+        _profile_index.load_dir(RAG_CORPUS_DIR, since=_profile_index.built_at)
+    else:
+        _profile_index.load_dir(RAG_CORPUS_DIR)
+    try:
+        _profile_index.save()
+    except OSError:
+        pass    # read-only checkout: serve from memory
+    _indexer.start()
+
+
+def _rag_query_profiles(query: str, top_k: int = 8) -> Dict[str, float]:
+    """Return {profile_id: similarity} from RAG retrieval, best first (best-effort)."""
+    try:
+        return dict(_profile_index.query(query, top_k))
+    except Exception:
+        return {}
 
 
 # ---------------------------------------------------------------------------
@@ -125,6 +183,9 @@ class RankContactRequest(BaseModel):
     query_help_type: str = ""
     urgency: str = "medium"
     candidates: List[ContactProfile]
+    max_concurrency: int = RANK_MAX_CONCURRENCY
+    deadline_ms: int = RANK_DEADLINE_MS
+    llm_shortlist: int = RANK_LLM_SHORTLIST
 
 
 class DraftOutreachRequest(BaseModel):
@@ -170,22 +231,113 @@ def _safe_call(result: dict, field: str, fallback):
         return fallback
 
 
+RANK_CONTACT_TOOLS = [{
+    "name": "rank_contact",
+    "description": "Score how well a contact matches a networking query",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "contact_id":     {"type": "string"},
+            "match_score":    {"type": "number",  "description": "0.0-1.0"},
+            "match_reason":   {"type": "string",  "description": "One sentence why they match"},
+            "outreach_angle": {"type": "string",  "description": "One sentence suggested opening"}
+        },
+        "required": ["contact_id", "match_score", "match_reason", "outreach_angle"]
+    }
+}]
+
+
+def _ranking_from_result(result: dict, contact_id: str) -> dict:
+    args = {}
+    try:
+        args = result["function_calls"][0]["arguments"]
+    except (KeyError, IndexError):
+        pass
+    return {
+        "contact_id":     contact_id,     # the candidate ranked, never an id the model made up
+        "match_score":    float(args.get("match_score", 0.0)),
+        "match_reason":   args.get("match_reason", ""),
+        "outreach_angle": args.get("outreach_angle", ""),
+        "source":         result.get("source", "unknown"),
+    }
+
+
+# Rankings are reused until the profile's content changes (the version is a
+# hash of the text the model saw) or /ai/sync-profile-rag invalidates it.
+_rank_cache = RankCache(int(RANK_CACHE_MAX_MB * 1024 * 1024), RANK_CACHE_PATH or None)
+
+
+async def _cached_ranking(query_looking_for: str, query_domain: str, contact_id: str, contact_text: str) -> dict:
+    query = normalize_query(query_looking_for, query_domain)
+    version = content_version(contact_text)
+    cached = _rank_cache.get(query, contact_id, version)
+    if cached is not None:
+        return dict(cached, cached=True)
+    messages = [{
+        "role": "user",
+        "content": (
+            f"I need a {query_looking_for} in {query_domain}. "
+            f"Rate this contact: {contact_text}"
+        )
+    }]
+    result = await generate_hybrid_async(messages, RANK_CONTACT_TOOLS)
+    ranking = _ranking_from_result(result, contact_id)
+    if result.get("function_calls"):
+        _rank_cache.put(query, contact_id, version, ranking)
+    return ranking
+
+
+async def _rank_profile(req: RankContactRequest, contact: ContactProfile) -> dict:
+    return await _cached_ranking(req.query_looking_for, req.query_domain, contact.id, _profile_to_text(contact))
+
+
+def _prescored(contact: ContactProfile, score: float, matched: dict) -> dict:
+    """Ranking from the structured pre-score alone (no model call)."""
+    terms = matched.get("skills") or matched.get("domains") or matched.get("can_help_with")
+    return {
+        "contact_id":     contact.id,
+        "match_score":    round(float(score), 4),
+        "match_reason":   prescore_reason(contact, matched),
+        "outreach_angle": f"Ask {contact.name} about their work on {terms[0]}." if terms else "",
+        "source":         "prescore",
+        "prescore":       round(float(score), 4),
+    }
+
+
+def _unranked(prescored: dict, source: str) -> dict:
+    """Placeholder for a shortlisted contact whose model ranking missed the
+    deadline or failed: keeps the pre-score, flagged partial."""
+    return dict(prescored, source=source, partial=True)
+
+
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
 
 @app.get("/ai/health")
 def health():
+    index_stats = _indexer.stats()
     return {
         "status": "ok",
         "cactus_available": _HAS_CACTUS,
-        "rag_available": _HAS_RAG,
-        "rag_model_loaded": _rag_model is not None,
+        "local_backend": LOCAL_BACKEND,
+        # Queries work off any loaded snapshot, but syncs only land while the indexer runs
+        "rag_available": index_stats["loaded"] and index_stats["indexer_alive"],
+        "rag_generation": index_stats["generation"],
+        "rag_embedder": "cactus" if _query_embed_pool is not None else "hashed",
+        "model_pool": pool_stats(),
+        "result_cache": cache_stats(),
+        "tool_registry": tool_registry_stats(),
+        # avg/max_wait_ms on these pools is the time queries spent waiting for a handle
+        "rag_query_pool": _query_embed_pool.stats() if _query_embed_pool is not None else None,
+        "rag_index_pool": _index_embed_pool.stats() if _index_embed_pool is not None else None,
+        "profile_index": index_stats,
+        "rank_cache": _rank_cache.stats(),
     }
 
 
 @app.post("/ai/summarize-bio")
-def summarize_bio(req: SummarizeBioRequest):
+async def summarize_bio(req: SummarizeBioRequest):
     """Generate a one-liner professional bio summary (likely on-device)."""
     tools = [{
         "name": "generate_bio_summary",
@@ -210,13 +362,13 @@ def summarize_bio(req: SummarizeBioRequest):
             f"Skills: {skills_str}. Looking for: {looking_str}."
         )
     }]
-    result = generate_hybrid(messages, tools)
+    result = await generate_hybrid_async(messages, tools)
     bio = _safe_call(result, "bio_summary", f"{req.role} at {req.company}")
     return {"bio_summary": bio, "source": result.get("source", "unknown")}
 
 
 @app.post("/ai/rank-contact")
-def rank_contact(req: dict):
+async def rank_contact(req: dict):
     """Rank a single contact against a query (on-device for clear matches)."""
     query_looking_for = req.get("query_looking_for", "")
     query_domain = req.get("query_domain", "")
@@ -230,105 +382,114 @@ def rank_contact(req: dict):
         f"Looking For: {', '.join(contact.get('looking_for', []))}, "
         f"Domains: {', '.join(contact.get('domains', []))}"
     )
-    tools = [{
-        "name": "rank_contact",
-        "description": "Score how well a contact matches a networking query",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "contact_id":     {"type": "string"},
-                "match_score":    {"type": "number",  "description": "0.0-1.0"},
-                "match_reason":   {"type": "string",  "description": "One sentence why they match"},
-                "outreach_angle": {"type": "string",  "description": "One sentence suggested opening"}
-            },
-            "required": ["contact_id", "match_score", "match_reason", "outreach_angle"]
-        }
-    }]
-    messages = [{
-        "role": "user",
-        "content": (
-            f"I need a {query_looking_for} in {query_domain}. "
-            f"Rate this contact: {contact_text}"
-        )
-    }]
-    result = generate_hybrid(messages, tools)
-    args = {}
-    try:
-        args = result["function_calls"][0]["arguments"]
-    except (KeyError, IndexError):
-        pass
-    return {
-        "contact_id":     args.get("contact_id", contact_id),
-        "match_score":    float(args.get("match_score", 0.0)),
-        "match_reason":   args.get("match_reason", ""),
-        "outreach_angle": args.get("outreach_angle", ""),
-        "source":         result.get("source", "unknown"),
-    }
+    return await _cached_ranking(query_looking_for, query_domain, contact_id, contact_text)
 
 
-@app.post("/ai/rank-contacts")
-def rank_contacts(req: RankContactRequest):
-    """Rank multiple contacts. Uses Cactus RAG to pre-filter, then rank each."""
+async def _ranking_events(req: RankContactRequest):
+    """Rank ``req.candidates``, yielding events as results become available.
+
+    First one "ranking" event per candidate in pre-score order (shortlisted
+    ones with ``final: false``), then a final "ranking" for each shortlisted
+    contact as its model call finishes, then one "summary" with the sorted
+    rankings. ``candidate_id`` on ranking events is always the requested id.
+    """
     query = f"{req.query_looking_for} {req.query_domain} {req.query_help_type}"
 
-    # RAG pre-filter: get candidate profile IDs by semantic similarity
-    rag_ids = _rag_query_profiles(query, top_k=8)
+    # RAG similarity is one input to the pre-score; candidates outside the
+    # corpus just get none
+    rag_scores = await asyncio.to_thread(_rag_query_profiles, query, max(8, len(req.candidates)))
+    scores, matched = prescore(
+        {"need": f"{req.query_looking_for} {req.query_help_type}", "domain": req.query_domain},
+        req.candidates, rag_scores,
+    )
+    order = sorted(range(len(req.candidates)), key=lambda i: -scores[i])
+    prescored = {c.id: _prescored(c, scores[i], matched[i]) for i, c in enumerate(req.candidates)}
+
+    # Only contacts with some structured overlap are worth a model call
+    shortlist_size = max(0, min(req.llm_shortlist, RANK_LLM_SHORTLIST))
+    shortlist = [req.candidates[i] for i in order[:shortlist_size] if scores[i] > 0]
+    rest = [prescored[req.candidates[i].id] for i in order[len(shortlist):]]
+    for contact in shortlist:
+        yield dict(prescored[contact.id], type="ranking", candidate_id=contact.id, final=False)
+    for ranking in rest:
+        yield dict(ranking, type="ranking", candidate_id=ranking["contact_id"], final=True)
+
+    # Fan out across a bounded number of in-flight rankings; anything still
+    # running at the deadline keeps its pre-score and is flagged partial.
+    limit = max(1, min(req.max_concurrency, RANK_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+
+    async def rank_bounded(contact: ContactProfile) -> dict:
+        async with semaphore:
+            return await _rank_profile(req, contact)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(req.deadline_ms, 0) / 1000
+    tasks = {asyncio.create_task(rank_bounded(c)): c for c in shortlist}
+    pending = set(tasks)
+    ranked = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(deadline - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for task in done:
+                contact = tasks[task]
+                if task.exception() is not None:
+                    ranking = _unranked(prescored[contact.id], "error")
+                else:
+                    ranking = dict(task.result(), prescore=prescored[contact.id]["prescore"])
+                ranked.append(ranking)
+                yield dict(ranking, type="ranking", candidate_id=contact.id, final=True)
+        for task in pending:
+            task.cancel()
+            ranking = _unranked(prescored[tasks[task].id], "timeout")
+            ranked.append(ranking)
+            yield dict(ranking, type="ranking", candidate_id=tasks[task].id, final=True)
+    finally:
+        # Client gone mid-stream: don't leave model calls running
+        for task in tasks:
+            task.cancel()
+
+    # The shortlist stays ahead of the pre-scored tail: model and pre-scores are
+    # on different scales, and the tail scored lower by construction
+    ranked.sort(key=lambda r: r["match_score"], reverse=True)
+    rankings = ranked + rest
+    yield {
+        "type": "summary",
+        "rankings": rankings,
+        "partial": any(r.get("partial") for r in rankings),
+        "llm_calls": len(tasks),
+    }
 
-    # If RAG returned IDs, restrict candidates to those; otherwise use all
-    if rag_ids:
-        ordered_candidates = sorted(
-            req.candidates,
-            key=lambda c: (rag_ids.index(c.id) if c.id in rag_ids else len(rag_ids))
-        )
-        candidates_to_rank = ordered_candidates[:min(len(rag_ids), len(req.candidates))]
-    else:
-        candidates_to_rank = req.candidates
 
-    tools = [{
-        "name": "rank_contact",
-        "description": "Score how well a contact matches a networking query",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "contact_id":     {"type": "string"},
-                "match_score":    {"type": "number",  "description": "0.0-1.0"},
-                "match_reason":   {"type": "string",  "description": "One sentence why they match"},
-                "outreach_angle": {"type": "string",  "description": "One sentence suggested opening"}
-            },
-            "required": ["contact_id", "match_score", "match_reason", "outreach_angle"]
-        }
-    }]
+@app.post("/ai/rank-contacts")
+async def rank_contacts(req: RankContactRequest):
+    """Rank multiple contacts. Every candidate is pre-scored on its structured
+    fields (blended with RAG similarity); only the best few are ranked by the
+    model, concurrently under a per-request concurrency limit and deadline."""
+    summary = None
+    async for event in _ranking_events(req):
+        if event["type"] == "summary":
+            summary = event
+    return {"rankings": summary["rankings"], "partial": summary["partial"], "llm_calls": summary["llm_calls"]}
 
-    rankings = []
-    for contact in candidates_to_rank:
-        contact_text = _profile_to_text(contact)
-        messages = [{
-            "role": "user",
-            "content": (
-                f"I need a {req.query_looking_for} in {req.query_domain}. "
-                f"Rate this contact: {contact_text}"
-            )
-        }]
-        result = generate_hybrid(messages, tools)
-        args = {}
-        try:
-            args = result["function_calls"][0]["arguments"]
-        except (KeyError, IndexError):
-            pass
-        rankings.append({
-            "contact_id":     args.get("contact_id", contact.id),
-            "match_score":    float(args.get("match_score", 0.0)),
-            "match_reason":   args.get("match_reason", ""),
-            "outreach_angle": args.get("outreach_angle", ""),
-            "source":         result.get("source", "unknown"),
-        })
 
-    rankings.sort(key=lambda r: r["match_score"], reverse=True)
-    return {"rankings": rankings}
+@app.post("/ai/rank-contacts/stream")
+async def rank_contacts_stream(req: RankContactRequest):
+    """Like /ai/rank-contacts, but streams NDJSON: each contact's ranking as
+    soon as it is known, then a final sorted "summary" line."""
+    async def ndjson():
+        async for event in _ranking_events(req):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 
 @app.post("/ai/draft-outreach")
-def draft_outreach(req: DraftOutreachRequest):
+async def draft_outreach(req: DraftOutreachRequest):
     """Draft a warm, personalised outreach message (cloud for quality)."""
     tools = [{
         "name": "draft_outreach_message",
@@ -357,7 +518,7 @@ def draft_outreach(req: DraftOutreachRequest):
             f"Context: {context}"
         )
     }]
-    result = generate_hybrid(messages, tools)
+    result = await generate_hybrid_async(messages, tools)
     message_text = _safe_call(result, "message", "")
     if not message_text:
         message_text = (
@@ -369,8 +530,8 @@ def draft_outreach(req: DraftOutreachRequest):
 
 
 @app.post("/ai/sync-profile-rag")
-def sync_profile_rag(req: SyncProfileRequest):
-    """Write/overwrite the .txt for this profile and reload the RAG model."""
+async def sync_profile_rag(req: SyncProfileRequest):
+    """Write/overwrite the .txt for this profile and queue it for reindexing."""
     os.makedirs(RAG_CORPUS_DIR, exist_ok=True)
     txt_path = os.path.join(RAG_CORPUS_DIR, f"{req.profile_id}.txt")
     content = (
@@ -387,10 +548,17 @@ def sync_profile_rag(req: SyncProfileRequest):
     with open(txt_path, "w") as f:
         f.write(content)
 
-    # Reload RAG model with updated corpus (separate from generate_hybrid singleton)
-    _load_rag_model()
+    # Returns immediately; the indexer picks it up in its next batch
+    _indexer.submit(req.profile_id, content)
+    _rank_cache.invalidate(req.profile_id)
 
-    return {"status": "ok", "profile_id": req.profile_id, "path": txt_path}
+    return {
+        "status": "ok",
+        "profile_id": req.profile_id,
+        "path": txt_path,
+        "generation": _profile_index.generation,
+        "pending": _indexer.stats()["pending"],
+    }
 
 
 # ---------------------------------------------------------------------------
@@ -400,7 +568,18 @@ def sync_profile_rag(req: SyncProfileRequest):
 @app.on_event("startup")
 def on_startup():
     os.makedirs(RAG_CORPUS_DIR, exist_ok=True)
-    _load_rag_model()
+    _load_profile_index()
+    _rank_cache.load()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    _indexer.flush(timeout=10)
+    _indexer.stop(timeout=10)
+    try:
+        _rank_cache.save()
+    except OSError:
+        pass    # read-only checkout: the cache just starts cold next time
 
 
 # Voice Note Processing
@@ -483,7 +662,7 @@ VOICE_NOTE_TOOLS = [
 
 
 @app.post("/ai/process-voice-note")
-def process_voice_note(req: VoiceNoteRequest):
+async def process_voice_note(req: VoiceNoteRequest):
     """
     Process voice note using FunctionGemma tool calling.
     
@@ -516,7 +695,7 @@ def process_voice_note(req: VoiceNoteRequest):
 First, look up the contact mentioned. Then draft a follow-up email."""
         }]
         
-        result = generate_hybrid(messages, VOICE_NOTE_TOOLS)
+        result = await generate_hybrid_async(messages, VOICE_NOTE_TOOLS)
         source = result.get("source", "hybrid")
         
         # Step 3: Execute tool calls
@@ -527,7 +706,7 @@ First, look up the contact mentioned. Then draft a follow-up email."""
                 
                 if tool_name == "lookup_contact":
                     name = tool_args.get("name", "")
-                    contact_info = _lookup_contact_in_db(name)
+                    contact_info = await asyncio.to_thread(_lookup_contact_in_db, name)
                     tool_calls_log.append({"tool": "lookup_contact", "args": {"name": name}, "result": contact_info})
                     
                 elif tool_name == "draft_email":
@@ -556,7 +735,7 @@ Best regards"""
             match = re.search(r'(?:meeting|met|with)\s+([A-Z][a-z]+)', transcript)
             if match:
                 name = match.group(1)
-                contact_info = _lookup_contact_in_db(name)
+                contact_info = await asyncio.to_thread(_lookup_contact_in_db, name)
                 tool_calls_log.append({"tool": "lookup_contact", "args": {"name": name}, "result": contact_info, "source": "fallback"})
         
         # Generate email if we have contact but no draft
@@ -591,7 +770,7 @@ Best regards"""
         # Fallback to demo mode when API fails
         try:
             from voice_demo import process_voice_note_demo
-            demo_result = process_voice_note_demo(transcript)
+            demo_result = await asyncio.to_thread(process_voice_note_demo, transcript)
             contact = demo_result.get("contact") or {}
             email = demo_result.get("email_draft") or {}
             
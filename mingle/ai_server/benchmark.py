@@ -6,7 +6,13 @@ _REPO_ROOT = str(pathlib.Path(__file__).resolve().parents[2])
 sys.path.insert(0, os.path.join(_REPO_ROOT, "cactus/python/src"))
 os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
 
+import argparse
+import csv
 import json
+import math
+import random
+import time
+import main
 from main import generate_hybrid
 
 
@@ -410,13 +416,15 @@ def run_benchmark(benchmarks=None):
         result = generate_hybrid(case["messages"], case["tools"])
         f1 = compute_f1(result["function_calls"], case["expected_calls"])
         source = result.get("source", "unknown")
-        print(f"F1={f1:.2f} | {result['total_time_ms']:.0f}ms | {source}")
+        fast_path = result.get("fast_path")
+        print(f"F1={f1:.2f} | {result['total_time_ms']:.0f}ms | {source}{' (fast path)' if fast_path else ''}")
         results.append({
             "name": case["name"],
             "difficulty": case["difficulty"],
             "total_time_ms": result["total_time_ms"],
             "f1": f1,
             "source": source,
+            "fast_path": fast_path,
             "predicted": result["function_calls"],
             "expected": case["expected_calls"],
         })
@@ -425,7 +433,8 @@ def run_benchmark(benchmarks=None):
     print(f"  {'#':>2} | {'Difficulty':<10} | {'Name':<28} | {'Time (ms)':>10} | {'F1':>5} | Source")
     print(f"  {'--':>2}-+-{'-'*10}-+-{'-'*28}-+-{'-'*10}-+-{'-'*5}-+-{'-'*20}")
     for i, r in enumerate(results, 1):
-        print(f"  {i:>2} | {r['difficulty']:<10} | {r['name']:<28} | {r['total_time_ms']:>10.2f} | {r['f1']:>5.2f} | {r['source']}")
+        marker = f" [fast path: {r['fast_path']}]" if r["fast_path"] else ""
+        print(f"  {i:>2} | {r['difficulty']:<10} | {r['name']:<28} | {r['total_time_ms']:>10.2f} | {r['f1']:>5.2f} | {r['source']}{marker}")
 
     print(f"\n--- Summary ---")
     for difficulty in ["easy", "medium", "hard"]:
@@ -446,6 +455,18 @@ def run_benchmark(benchmarks=None):
     print(f"  {'overall':<8} avg F1={avg_f1:.2f}  avg time={avg_time:.2f}ms  total time={total_time:.2f}ms")
     print(f"           on-device={on_device_total}/{len(results)} ({100*on_device_total/len(results):.0f}%)  cloud={cloud_total}/{len(results)} ({100*cloud_total/len(results):.0f}%)")
 
+    # The rule-based fast path answers without the model; report it apart so a
+    # high score isn't mistaken for model-routing quality
+    fast = [r for r in results if r["fast_path"]]
+    routed = [r for r in results if not r["fast_path"]]
+    if main._FAST_PATH_ENABLED:
+        print(f"  fast path: {len(fast)}/{len(results)} answered by rules (no model)"
+              + (f", avg F1={sum(r['f1'] for r in fast) / len(fast):.2f}" if fast else ""))
+    if routed and fast:
+        print(f"  model-routed only: score={compute_total_score(routed):.1f}% over {len(routed)} cases")
+    elif not routed:
+        print("  no case reached model routing; rerun without --with-fast-path to measure it")
+
     # Total score
     score = compute_total_score(results)
     print(f"\n{'='*50}")
@@ -455,6 +476,32 @@ def run_benchmark(benchmarks=None):
     return results
 
 
+def report_fast_path_coverage(benchmarks=None):
+    """Score the rule-based fast path on its own: which cases it answers, and how well.
+
+    Kept apart from the routing score, which runs with the fast path off.
+    """
+    if benchmarks is None:
+        benchmarks = BENCHMARKS
+    enabled = main._FAST_PATH_ENABLED
+    main._FAST_PATH_ENABLED = True
+    try:
+        hits = [(case, main._fast_path_result(case["messages"], case["tools"], time.time())) for case in benchmarks]
+    finally:
+        main._FAST_PATH_ENABLED = enabled
+    answered = [(case, result) for case, result in hits if result is not None]
+    print(f"\n--- Fast-path coverage (not in the score) ---")
+    for difficulty in ["easy", "medium", "hard"]:
+        group = [case for case in benchmarks if case["difficulty"] == difficulty]
+        if group:
+            n = sum(1 for case, _ in answered if case["difficulty"] == difficulty)
+            print(f"  {difficulty:<8} answered by rules={n}/{len(group)}")
+    f1s = [compute_f1(result["function_calls"], case["expected_calls"]) for case, result in answered]
+    print(f"  {'overall':<8} answered by rules={len(answered)}/{len(benchmarks)}"
+          + (f"  avg F1={sum(f1s) / len(f1s):.2f}" if f1s else ""))
+    return {"answered": len(answered), "total": len(benchmarks), "avg_f1": sum(f1s) / len(f1s) if f1s else None}
+
+
 def compute_total_score(results):
     """
     Compute a total score from 0-100% as a weighted sum across difficulty levels.
@@ -490,5 +537,155 @@ def compute_total_score(results):
     return total_score * 100
 
 
+############## Repeated runs with statistics ##############
+
+def _percentile(values, pct):
+    """Linear-interpolated percentile of a non-empty list (pct in 0-100)."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100
+    lo = math.floor(rank)
+    hi = math.ceil(rank)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+def _latency_stats(times):
+    n = len(times)
+    mean = sum(times) / n
+    std = math.sqrt(sum((t - mean) ** 2 for t in times) / (n - 1)) if n > 1 else 0.0
+    return {
+        "n": n,
+        "mean_ms": mean,
+        "std_ms": std,
+        "p50_ms": _percentile(times, 50),
+        "p90_ms": _percentile(times, 90),
+        "p99_ms": _percentile(times, 99),
+    }
+
+
+def _group_stats(rows, key):
+    groups = {}
+    for r in rows:
+        groups.setdefault(r[key], []).append(r)
+    return {
+        k: dict(_latency_stats([r["total_time_ms"] for r in g]), avg_f1=sum(r["f1"] for r in g) / len(g))
+        for k, g in sorted(groups.items())
+    }
+
+
+def bootstrap_score_ci(results, iterations=1000, confidence=0.95, seed=0):
+    """Bootstrap CI for compute_total_score, resampling cases within each difficulty.
+
+    Runs of one case are correlated, so a case is drawn with all of its runs;
+    resampling runs independently would understate the width.
+    """
+    rng = random.Random(seed)
+    by_difficulty = {}
+    for r in results:
+        by_difficulty.setdefault(r["difficulty"], {}).setdefault(r["name"], []).append(r)
+    scores = []
+    for _ in range(iterations):
+        sample = []
+        for cases in by_difficulty.values():
+            runs = list(cases.values())
+            for _ in runs:
+                sample.extend(rng.choice(runs))
+        scores.append(compute_total_score(sample))
+    alpha = (1 - confidence) / 2 * 100
+    return _percentile(scores, alpha), _percentile(scores, 100 - alpha)
+
+
+def run_benchmark_repeated(benchmarks=None, repeats=5, bootstrap=1000, seed=0, out_prefix=None):
+    """Run every case ``repeats`` times and report latency distributions.
+
+    The first run of each case is reported separately ("first"): it pays the
+    per-prompt costs a repeat doesn't. It is not a cold start: the model pool
+    is already warm after the first case. The score, its bootstrap CI and the
+    summary tables use the repeat runs. The result
+    cache is bypassed so every repetition is a real inference. With
+    ``out_prefix``, per-run rows are written to ``<prefix>.csv`` and the full
+    report to ``<prefix>.json``.
+    """
+    if benchmarks is None:
+        benchmarks = BENCHMARKS
+
+    rows = []
+    total = len(benchmarks)
+    for i, case in enumerate(benchmarks, 1):
+        print(f"[{i}/{total}] Running: {case['name']} ({case['difficulty']}) x{repeats}...", end=" ", flush=True)
+        times = []
+        for run in range(repeats):
+            result = generate_hybrid(case["messages"], case["tools"], use_cache=False)
+            f1 = compute_f1(result["function_calls"], case["expected_calls"])
+            times.append(result["total_time_ms"])
+            rows.append({
+                "name": case["name"],
+                "difficulty": case["difficulty"],
+                "run": run,
+                "phase": "first" if run == 0 else "repeat",
+                "total_time_ms": result["total_time_ms"],
+                "f1": f1,
+                "source": result.get("source", "unknown"),
+                "fast_path": result.get("fast_path") or "",
+            })
+        print(f"p50={_percentile(times, 50):.0f}ms max={max(times):.0f}ms")
+
+    first = [r for r in rows if r["phase"] == "first"]
+    repeat = [r for r in rows if r["phase"] == "repeat"] or first
+    report = {
+        "repeats": repeats,
+        "score": compute_total_score(repeat),
+        "score_ci95": bootstrap_score_ci(repeat, iterations=bootstrap, seed=seed) if bootstrap else None,
+        "first_run": _latency_stats([r["total_time_ms"] for r in first]),
+        "repeat_by_difficulty": _group_stats(repeat, "difficulty"),
+        "repeat_by_source": _group_stats(repeat, "source"),
+        "first_run_by_difficulty": _group_stats(first, "difficulty"),
+    }
+
+    header = f"  {'Group':<22} | {'n':>4} | {'mean':>8} | {'std':>8} | {'p50':>8} | {'p90':>8} | {'p99':>8} | {'F1':>5}"
+    for title, table in [("Repeat runs by difficulty", report["repeat_by_difficulty"]),
+                         ("Repeat runs by source", report["repeat_by_source"]),
+                         ("First run per case by difficulty", report["first_run_by_difficulty"])]:
+        print(f"\n=== {title} (ms) ===\n")
+        print(header)
+        print(f"  {'-'*22}-+-{'-'*4}-+-{'-'*8}-+-{'-'*8}-+-{'-'*8}-+-{'-'*8}-+-{'-'*8}-+-{'-'*5}")
+        for group, st in table.items():
+            print(f"  {group:<22} | {st['n']:>4} | {st['mean_ms']:>8.1f} | {st['std_ms']:>8.1f} | "
+                  f"{st['p50_ms']:>8.1f} | {st['p90_ms']:>8.1f} | {st['p99_ms']:>8.1f} | {st['avg_f1']:>5.2f}")
+
+    print(f"\n{'='*50}")
+    print(f"  TOTAL SCORE (repeats): {report['score']:.1f}%")
+    if report["score_ci95"]:
+        lo, hi = report["score_ci95"]
+        print(f"  95% bootstrap CI     : [{lo:.1f}%, {hi:.1f}%]")
+    print(f"{'='*50}")
+
+    if out_prefix:
+        with open(f"{out_prefix}.json", "w") as f:
+            json.dump({"report": report, "runs": rows}, f, indent=2)
+        with open(f"{out_prefix}.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Wrote {out_prefix}.json and {out_prefix}.csv")
+
+    return report, rows
+
+
 if __name__ == "__main__":
-    run_benchmark()
+    parser = argparse.ArgumentParser(description="Run the hybrid routing benchmark")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per case; >1 reports percentiles and first-run/repeat split")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap iterations for the score CI (0 = off)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for bootstrap resampling")
+    parser.add_argument("--out", type=str, default=None, help="Write <out>.json and <out>.csv with per-run results")
+    parser.add_argument("--with-fast-path", action="store_true",
+                        help="Score with the rule-based fast path on (it answers most cases without the model)")
+    args = parser.parse_args()
+    # The headline score measures model routing; the rules' coverage is reported apart
+    main._FAST_PATH_ENABLED = main._FAST_PATH_ENABLED and args.with_fast_path
+    if args.repeats > 1 or args.out:
+        run_benchmark_repeated(repeats=args.repeats, bootstrap=args.bootstrap, seed=args.seed, out_prefix=args.out)
+    else:
+        run_benchmark()
+    report_fast_path_coverage()
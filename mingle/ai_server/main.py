@@ -7,7 +7,10 @@ _REPO_ROOT = _os.path.normpath(_os.path.join(_os.path.dirname(_os.path.abspath(_
 sys.path.insert(0, _os.path.join(_REPO_ROOT, "cactus/python/src"))
 functiongemma_path = _os.path.join(_REPO_ROOT, "cactus/weights/functiongemma-270m-it")
 
-import json, os, time
+import asyncio, contextvars, copy, difflib, hashlib, json, math, os, random, re, threading, time, zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Load .env from repo root if present (dev convenience — does not override existing env vars)
 try:
@@ -16,19 +19,193 @@ try:
 except ImportError:
     pass
 
-from cactus import cactus_init, cactus_complete, cactus_destroy
+# MINGLE_LOCAL_BACKEND=sim swaps Cactus for the deterministic simulator in
+# sim_backends.py so routing can be measured without the native build.
+LOCAL_BACKEND = os.environ.get("MINGLE_LOCAL_BACKEND", "cactus")
+if LOCAL_BACKEND == "sim":
+    from sim_backends import cactus_init, cactus_complete, cactus_destroy, cactus_stop
+else:
+    from cactus import cactus_init, cactus_complete, cactus_destroy, cactus_stop
+import httpx
+try:
+    import numpy as np
+except ImportError:     # learned router is optional; heuristics still work without it
+    np = None
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
 
 
-# --- Model persistence singleton ---
-_cactus_model = None
+# --- Model pool ---
+class PoolExhausted(RuntimeError):
+    """Raised when every handle is busy and the wait queue is full (or timed out)."""
+
+
+class ModelPool:
+    """Thread-safe pool of Cactus model handles.
+
+    Handles are created lazily, up to ``size``. ``borrow()`` checks one out for
+    the duration of a ``with`` block; if the block raises, the handle is
+    destroyed rather than reused and a fresh one is initialised on a later
+    checkout, since a failed native call can leave its context corrupted.
+    When all handles are busy, at most ``max_waiters`` callers queue for the
+    next free one; anyone beyond that, or anyone who waits longer than
+    ``timeout`` seconds, gets ``PoolExhausted``.
+    """
+
+    def __init__(self, factory, size=1, max_waiters=16, timeout=30.0, destroy=None):
+        self._factory = factory
+        self._destroy = destroy
+        self.size = max(1, int(size))
+        self.max_waiters = max(0, int(max_waiters))
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle = []
+        self._checked_out = {}      # id(handle) -> checkout timestamp
+        self._created = 0
+        self._waiting = 0
+        self._closed = False
+        self._started = time.time()
+        # metrics
+        self._checkouts = 0
+        self._rejected = 0
+        self._wait_total_ms = 0.0
+        self._wait_max_ms = 0.0
+        self._busy_ms = 0.0
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.time()
+        create = False
+        with self._cond:
+            if self._closed:
+                raise PoolExhausted("model pool is closed")
+            if not self._idle and self._created >= self.size:
+                if self._waiting >= self.max_waiters:
+                    self._rejected += 1
+                    raise PoolExhausted(f"model pool busy ({self.size} in use, {self._waiting} waiting)")
+                self._waiting += 1
+                try:
+                    deadline = start + timeout
+                    while not self._idle and self._created >= self.size and not self._closed:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self._rejected += 1
+                            raise PoolExhausted(f"timed out after {timeout:.1f}s waiting for a model handle")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                if self._closed:
+                    raise PoolExhausted("model pool is closed")
+            if self._idle:
+                handle = self._idle.pop()
+            else:
+                self._created += 1      # reserve the slot; init happens outside the lock
+                create = True
+
+        if create:
+            try:
+                handle = self._factory()
+            except BaseException:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+
+        now = time.time()
+        wait_ms = (now - start) * 1000
+        with self._cond:
+            self._checked_out[id(handle)] = now
+            self._checkouts += 1
+            self._wait_total_ms += wait_ms
+            self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+        return handle
+
+    def release(self, handle, discard=False):
+        """Return a handle. ``discard=True`` destroys it (e.g. after a native error)."""
+        with self._cond:
+            taken = self._checked_out.pop(id(handle), None)
+            if taken is not None:
+                self._busy_ms += (time.time() - taken) * 1000
+            if discard or self._closed:
+                self._created -= 1
+            else:
+                self._idle.append(handle)
+            self._cond.notify()
+        if discard or self._closed:
+            self._destroy_handle(handle)
+
+    @contextmanager
+    def borrow(self, timeout=None):
+        handle = self.acquire(timeout)
+        try:
+            yield handle
+        except BaseException:
+            self.release(handle, discard=True)
+            raise
+        self.release(handle)
+
+    def warm(self, n=1):
+        """Eagerly create up to ``n`` handles so the first requests skip init."""
+        handles = [self.acquire() for _ in range(min(n, self.size))]
+        for h in handles:
+            self.release(h)
+
+    def close(self):
+        """Destroy idle handles now and busy ones as they are returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for h in idle:
+            self._destroy_handle(h)
+
+    def _destroy_handle(self, handle):
+        if self._destroy is None:
+            return
+        try:
+            self._destroy(handle)
+        except Exception:
+            pass
 
-def _get_cactus_model():
-    global _cactus_model
-    if _cactus_model is None:
-        _cactus_model = cactus_init(functiongemma_path)
-    return _cactus_model
+    def stats(self):
+        with self._cond:
+            elapsed_ms = max((time.time() - self._started) * 1000, 1e-6)
+            now = time.time()
+            busy_ms = self._busy_ms + sum((now - t) * 1000 for t in self._checked_out.values())
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": len(self._checked_out),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "max_waiters": self.max_waiters,
+                "checkouts": self._checkouts,
+                "rejected": self._rejected,
+                "avg_wait_ms": self._wait_total_ms / self._checkouts if self._checkouts else 0.0,
+                "max_wait_ms": self._wait_max_ms,
+                "utilization": busy_ms / (elapsed_ms * self.size),
+            }
+
+
+def _default_pool_size():
+    # Each FunctionGemma handle decodes on its own threads; leave headroom per handle.
+    return min(4, max(1, (os.cpu_count() or 2) // 2))
+
+
+_model_pool = ModelPool(
+    lambda: cactus_init(functiongemma_path),
+    size=int(os.environ.get("CACTUS_POOL_SIZE", _default_pool_size())),
+    max_waiters=int(os.environ.get("CACTUS_POOL_MAX_WAITERS", 16)),
+    timeout=float(os.environ.get("CACTUS_POOL_TIMEOUT_S", 30)),
+    destroy=cactus_destroy,
+)
+
+
+def pool_stats():
+    """Checkout/wait/utilization metrics for the generate_hybrid model pool."""
+    return _model_pool.stats()
 
 
 # --- Complexity classifier ---
@@ -51,6 +228,61 @@ def _classify_complexity(messages, tools) -> str:
     return "easy"
 
 
+# --- Learned fallback classifier ---
+# Logistic model over hashed n-grams plus a few dense features, trained from
+# benchmark traces by train_router.py. Predicts the probability that the local
+# pass will be rejected or wrong; routing falls back to the EMA tracker below
+# when NumPy or the model file is missing.
+_ROUTER_MODEL_PATH = os.environ.get(
+    "MINGLE_ROUTER_MODEL", _os.path.join(_os.path.dirname(_os.path.abspath(__file__)), "router_model.npz"),
+)
+_ROUTER_HASH_DIM = 1024
+_ROUTER_DENSE = 5   # tool count, verb count, conjunction count, tool-name overlap, log length
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def _router_hashed(tokens):
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    # crc32 is stable across processes, unlike hash()
+    return [zlib.crc32(g.encode()) for g in grams]
+
+
+def router_features(messages, tools, dim=_ROUTER_HASH_DIM):
+    """Feature vector (float32, length dim + _ROUTER_DENSE) for one request."""
+    user_text = " ".join(m["content"] for m in messages if m["role"] == "user").lower()
+    tokens = _TOKEN_RE.findall(user_text)
+    hashed = np.bincount(np.asarray(_router_hashed(tokens), dtype=np.int64) % dim, minlength=dim)
+    token_set = set(tokens)
+    name_parts = [set(t["name"].lower().split("_")) for t in tools]
+    overlap = sum(1 for parts in name_parts if parts & token_set) / max(len(tools), 1)
+    dense = [
+        len(tools) / 5,
+        sum(1 for v in _ACTION_VERBS if v in token_set) / 3,
+        sum(1 for kw in _MULTI_ACTION_KW if f" {kw} " in f" {user_text} ") / 3,
+        overlap,
+        np.log1p(len(tokens)) / 4,
+    ]
+    return np.concatenate([np.minimum(hashed, 3).astype(np.float32), np.asarray(dense, dtype=np.float32)])
+
+
+def _load_router_model(path):
+    if np is None or not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {"w": data["w"].astype(np.float32), "b": float(data["b"]), "dim": int(data["dim"])}
+
+
+_router_model = _load_router_model(_ROUTER_MODEL_PATH)
+
+
+def fallback_probability_batch(requests):
+    """P(local pass rejected or wrong) for a list of (messages, tools); None without a model."""
+    if _router_model is None:
+        return None
+    X = np.stack([router_features(m, t, _router_model["dim"]) for m, t in requests])
+    return 1.0 / (1.0 + np.exp(-(X @ _router_model["w"] + _router_model["b"])))
+
+
 # Per-complexity routing table
 _COMPLEXITY_CONFIG = {
     "easy":   {"tool_rag_top_k": 1, "confidence_threshold": 0.75, "max_tokens": 128},
@@ -58,6 +290,1254 @@ _COMPLEXITY_CONFIG = {
     "hard":   {"tool_rag_top_k": 0, "confidence_threshold": 0.97, "max_tokens": 320},
 }
 
+# Optional per-tier overrides, e.g. the output of tune.py
+if os.environ.get("MINGLE_ROUTING_CONFIG"):
+    with open(os.environ["MINGLE_ROUTING_CONFIG"]) as _f:
+        for _tier, _overrides in json.load(_f).items():
+            _COMPLEXITY_CONFIG[_tier].update(_overrides)
+
+
+# --- Hedged cloud dispatch ---
+# For requests likely to end up in the cloud anyway, start Gemini alongside the
+# local pass so a fallback costs max(local, cloud) instead of local + cloud.
+# "Likely" is the fallback probability alone, whatever the tier; a request the
+# splitter runs as per-clause passes is never hedged.
+_HEDGE_CONFIG = {
+    "enabled": os.environ.get("MINGLE_HEDGE", "1") != "0",
+    "min_fallback_prob": float(os.environ.get("MINGLE_HEDGE_MIN_PROB", 0.6)),
+    "budget_per_min": float(os.environ.get("MINGLE_HEDGE_BUDGET_PER_MIN", 30)),  # hedged Gemini calls/min
+}
+
+# Prior fallback rate per tier, refined online from observed routing outcomes
+_FALLBACK_PRIOR = {"easy": 0.2, "medium": 0.4, "hard": 0.8}
+_FALLBACK_EMA_ALPHA = 0.1
+
+
+class _FallbackTracker:
+    """Exponential moving average of how often each tier falls back to cloud."""
+
+    def __init__(self, prior, alpha):
+        self._rate = dict(prior)
+        self._alpha = alpha
+        self._lock = threading.Lock()
+
+    def record(self, complexity, fell_back):
+        with self._lock:
+            prev = self._rate.get(complexity, 0.5)
+            self._rate[complexity] = prev + self._alpha * (float(fell_back) - prev)
+
+    def rate(self, complexity):
+        return self._rate.get(complexity, 0.5)
+
+
+class _TokenBucket:
+    """Caps hedged cloud spend at ``per_min`` requests per minute (bursts up to the same)."""
+
+    def __init__(self, per_min):
+        self.capacity = max(0.0, per_min)
+        self._tokens = self.capacity
+        self._refill_per_s = self.capacity / 60.0
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self._refill_per_s)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+_fallback_tracker = _FallbackTracker(_FALLBACK_PRIOR, _FALLBACK_EMA_ALPHA)
+_hedge_budget = _TokenBucket(_HEDGE_CONFIG["budget_per_min"])
+
+
+def _new_cloud_executor():
+    return ThreadPoolExecutor(
+        max_workers=int(os.environ.get("MINGLE_HEDGE_WORKERS", 16)),
+        thread_name_prefix="gemini-hedge",
+    )
+
+
+_cloud_executor = _new_cloud_executor()
+
+
+# With a trained router, requests it is this sure about skip the local pass entirely
+_SKIP_LOCAL_PROB = float(os.environ.get("MINGLE_SKIP_LOCAL_PROB", 0.95))
+
+
+def _fallback_probability(messages, tools, complexity):
+    """Estimated probability that the local pass will be rejected (classifier, else per-tier EMA)."""
+    if _router_model is not None:
+        return float(fallback_probability_batch([(messages, tools)])[0])
+    return _fallback_tracker.rate(complexity)
+
+
+def _should_skip_local(p_fallback):
+    # Only trust the learned model here: skipping on the EMA would stop it ever updating
+    return _router_model is not None and p_fallback >= _SKIP_LOCAL_PROB
+
+
+def _should_hedge(p_fallback, split=False):
+    if not _HEDGE_CONFIG["enabled"] or split:
+        return False
+    # Only spend budget when we would actually hedge
+    return p_fallback >= _HEDGE_CONFIG["min_fallback_prob"] and _hedge_budget.take()
+
+
+# --- Result cache ---
+# Users repeat the same phrasings ("set a timer for 5 minutes"); serve those
+# from memory instead of paying another prefill/decode or Gemini round trip.
+_CACHE_CONFIG = {
+    "max_entries": int(os.environ.get("MINGLE_CACHE_SIZE", 1024)),
+    "ttl_s": float(os.environ.get("MINGLE_CACHE_TTL_S", 600)),
+}
+
+
+def _tools_hash(tools):
+    """Stable content hash of a tool list (key order and whitespace don't matter)."""
+    blob = json.dumps(tools, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _canonical_messages(messages):
+    return json.dumps(
+        [[m["role"], " ".join(str(m["content"]).split())] for m in messages],
+        separators=(",", ":"),
+    )
+
+
+class _ResultCache:
+    """Thread-safe LRU with per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries, ttl_s):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()   # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, result = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_s, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_result_cache = _ResultCache(_CACHE_CONFIG["max_entries"], _CACHE_CONFIG["ttl_s"])
+
+
+def cache_stats():
+    """Hit/miss/eviction counters for the generate_hybrid result cache."""
+    return _result_cache.stats()
+
+
+# --- Tool registry ---
+# The endpoints send the same tool lists over and over; compile each distinct
+# set once (keyed by content hash) into the Cactus wrapper and Gemini objects.
+
+
+class CompiledTools:
+    """One tool set, pre-built for both backends. Gemini objects are built on first use."""
+
+    def __init__(self, key, tools):
+        self.key = key
+        self.tools = tools
+        self.cactus_tools = [{"type": "function", "function": t} for t in tools]
+        self._gemini_config = None
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def derived(self, name, build):
+        """Memoize ``build(tools)`` under ``name``, for other per-tool-set artefacts."""
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build(self.tools)
+        return value
+
+    @property
+    def gemini_config(self):
+        if self._gemini_config is None:
+            with self._lock:
+                if self._gemini_config is None:
+                    self._gemini_config = types.GenerateContentConfig(tools=_gemini_tools(self.tools))
+        return self._gemini_config
+
+
+class _ToolRegistry:
+    """LRU of CompiledTools by tool-set content hash."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, tools):
+        key = _tools_hash(tools)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        # Snapshot the dicts so later mutation by the caller can't desync the cache
+        compiled = CompiledTools(key, copy.deepcopy(tools))
+        with self._lock:
+            compiled = self._entries.setdefault(key, compiled)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_tool_registry = _ToolRegistry(int(os.environ.get("MINGLE_TOOL_REGISTRY_SIZE", 256)))
+
+
+def compile_tools(tools):
+    """Return the cached CompiledTools for ``tools``, building it on first sight."""
+    return _tool_registry.compile(tools)
+
+
+def tool_registry_stats():
+    return _tool_registry.stats()
+
+
+# --- Tool retrieval index ---
+# Native tool_rag_top_k is off for the hard tier, so every schema lands in the
+# prompt and prefill grows with the catalog. Large catalogs are narrowed here
+# first: BM25 over each tool's name, description and parameter docs, held as a
+# contiguous (tools x terms) float32 matrix so a query is one column gather and
+# a row sum. Small catalogs (the common case) pass through untouched.
+_TOOL_INDEX_CONFIG = {
+    "enabled": os.environ.get("MINGLE_TOOL_INDEX", "1") != "0",
+    "min_tools": int(os.environ.get("MINGLE_TOOL_INDEX_MIN_TOOLS", 8)),
+    "top_k": int(os.environ.get("MINGLE_TOOL_INDEX_TOP_K", 6)),
+}
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+# Query words that point at a tool without sharing a word with its schema
+_INTENT_HINTS = {
+    "text": "message", "tell": "message", "wake": "alarm", "remind": "reminder",
+    "look": "search", "find": "search", "play": "song", "minute": "timer", "forecast": "weather",
+}
+_STOPWORDS = {"a", "an", "the", "to", "for", "of", "in", "on", "at", "by", "or", "and", "with", "my", "me", "is"}
+
+
+def _index_terms(text):
+    terms = []
+    for word in _TOKEN_RE.findall(text.lower().replace("_", " ")):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]    # "minutes" -> "minute", "contacts" -> "contact"
+        terms.append(word)
+    return terms
+
+
+def _tool_document(tool):
+    parts = [tool["name"], tool.get("description", "")]
+    for key, spec in tool.get("parameters", {}).get("properties", {}).items():
+        parts += [key, spec.get("description", "")]
+    return _index_terms(" ".join(parts))
+
+
+class ToolIndex:
+    """BM25 index over one tool set. ``top_k(text, k)`` returns the best-matching tools."""
+
+    def __init__(self, tools):
+        self.tools = list(tools)
+        docs = [_tool_document(t) for t in self.tools]
+        self.vocab = {}
+        for doc in docs:
+            for term in doc:
+                self.vocab.setdefault(term, len(self.vocab))
+        n = len(docs)
+        counts = [{} for _ in docs]
+        for row, doc in zip(counts, docs):
+            for term in doc:
+                row[self.vocab[term]] = row.get(self.vocab[term], 0) + 1
+        df = {}
+        for row in counts:
+            for j in row:
+                df[j] = df.get(j, 0) + 1
+        avg_len = sum(len(d) for d in docs) / max(n, 1) or 1.0
+        rows = []
+        for row, doc in zip(counts, docs):
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * len(doc) / avg_len)
+            rows.append({
+                j: math.log(1 + (n - df[j] + 0.5) / (df[j] + 0.5)) * tf * (_BM25_K1 + 1) / (tf + norm)
+                for j, tf in row.items()
+            })
+        if np is not None:
+            self.weights = np.zeros((n, len(self.vocab)), dtype=np.float32)
+            for i, row in enumerate(rows):
+                self.weights[i, list(row)] = list(row.values())
+        else:
+            self.weights = rows
+
+    def scores(self, text):
+        terms = _index_terms(text)
+        terms += [_INTENT_HINTS[t] for t in terms if t in _INTENT_HINTS]
+        ids = [self.vocab[t] for t in terms if t in self.vocab]
+        if np is not None:
+            return self.weights[:, ids].sum(axis=1) if ids else np.zeros(len(self.tools), dtype=np.float32)
+        return [sum(row.get(j, 0.0) for j in ids) for row in self.weights]
+
+    def top_k(self, text, k):
+        """Up to ``k`` tools with a positive score, best first."""
+        scores = self.scores(text)
+        if np is not None:
+            order = np.argsort(-scores, kind="stable")[:k]
+        else:
+            order = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+        return [self.tools[i] for i in order if scores[i] > 0]
+
+
+def _select_tools(messages, tools):
+    """Tools to offer the local model: all of a small set, the index's top-k of a large one.
+
+    A large catalog with no tool matching the request gives [] (the request goes
+    to the cloud) rather than the whole catalog.
+    """
+    if not _TOOL_INDEX_CONFIG["enabled"] or len(tools) <= _TOOL_INDEX_CONFIG["min_tools"]:
+        return tools
+    text = " ".join(m["content"] for m in messages if m["role"] == "user")
+    k = max(_TOOL_INDEX_CONFIG["top_k"], 2 * (_expected_call_count(messages, tools) or 1))
+    return compile_tools(tools).derived("tool_index", ToolIndex).top_k(text, k)
+
+
+# --- Rule-based fast path ---
+# Well-structured single intents ("set an alarm for 7:30 AM", "text Dave saying
+# hi") are answered by precompiled grammars without touching the model. A rule
+# binds to a tool by its argument names/types, not its name, and the grammar
+# must match the whole utterance; anything ambiguous falls through.
+_FAST_PATH_ENABLED = os.environ.get("MINGLE_FAST_PATH", "1") != "0"
+
+_TIME = r"(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>[ap]\.?\s?m\.?)?"
+_POLITE = r"(?:(?:please|can you|could you|would you|hey)[, ]+)*"
+_POLITE_TAIL = r"(?:,\s*(?:please|thanks|thank you))?[.!?]?"
+# Case-sensitive inside the otherwise IGNORECASE grammars: a name is capitalised,
+# so "text him ..." / "text my mom ..." fall through to the model
+_NAME = r"(?P<name>(?-i:[A-Z][\w'-]*(?: [A-Z][\w'-]*)?))"
+# Words that make a captured location or song depend on context the rules don't have
+_TEMPORAL_WORDS = {
+    "today", "tonight", "tomorrow", "yesterday", "now", "later", "morning", "afternoon",
+    "evening", "weekend", "week", "month", "next", "this", "monday", "tuesday", "wednesday",
+    "thursday", "friday", "saturday", "sunday",
+}
+_ANAPHORIC_WORDS = {"it", "that", "this", "there", "again", "same", "another", "more", "something", "them"}
+# A captured entity holding these is two things ("Paris and London") or not an
+# entity at all ("the game with me"): the model decides
+_CONJUNCTIONS = {"and", "or", "plus", "nor", "but"}
+_PERSONAL_WORDS = {"me", "my", "us", "our", "we", "i", "you", "your", "him", "her", "his"}
+_NON_MUSIC_WORDS = {"game", "games", "video", "videos", "movie", "film", "show", "episode", "podcast"}
+_POLITE_TAIL_RE = re.compile(r"(?:[\s,]+(?:please|thanks|thank you|for me|now))+$", re.IGNORECASE)
+
+
+def _fp_grammar(body):
+    return re.compile(rf"{_POLITE}{body}{_POLITE_TAIL}", re.IGNORECASE)
+
+
+def _props(tool):
+    return tool.get("parameters", {}).get("properties", {})
+
+
+def _find_prop(tool, kind, names):
+    """First property of JSON type ``kind`` whose name contains one of ``names``."""
+    for key, spec in _props(tool).items():
+        if spec.get("type") == kind and any(n in key.lower() for n in names):
+            return key
+    return None
+
+
+def _tool_mentions(tool, words):
+    text = f"{tool['name']} {tool.get('description', '')}".lower().replace("_", " ")
+    return any(w in text for w in words)
+
+
+def _to_24h(hour, ampm):
+    hour = int(hour)
+    if ampm:
+        pm = ampm.lower().startswith("p")
+        hour = hour % 12 + (12 if pm else 0)
+    return hour
+
+
+def _clock(m):
+    """Validated (hour, minute) of a _TIME match, or None when out of range or
+    ambiguous: a bare 1-12 hour without AM/PM could be either half of the day."""
+    hour, minute = int(m.group("hour")), int(m.group("minute") or 0)
+    if minute > 59:
+        return None
+    if m.group("ampm"):
+        return (hour, minute) if 1 <= hour <= 12 else None
+    return (hour, minute) if hour == 0 or 13 <= hour <= 23 else None
+
+
+def _context_free(value):
+    """True if a captured phrase stands on its own (no "tomorrow", "it", "again"...)."""
+    words = set(_TOKEN_RE.findall(value.lower()))
+    return bool(words) and not words & (_TEMPORAL_WORDS | _ANAPHORIC_WORDS)
+
+
+def _entity(value):
+    """A captured place, song or name without trailing politeness, or None if it
+    is not a single standalone entity."""
+    value = _clean(_POLITE_TAIL_RE.sub("", _clean(value)))
+    words = set(_TOKEN_RE.findall(value.lower()))
+    if not _context_free(value) or words & (_CONJUNCTIONS | _PERSONAL_WORDS):
+        return None
+    return value
+
+
+def _clock_string(m):
+    """"3pm" / "3:00 p.m." -> "3:00 PM" (the form our tool schemas document)."""
+    minute = m.group("minute") or "00"
+    ampm = m.group("ampm")
+    suffix = f" {'PM' if ampm.lower().startswith('p') else 'AM'}" if ampm else ""
+    return f"{int(m.group('hour'))}:{minute}{suffix}"
+
+
+def _clean(value):
+    return value.strip().strip(".,!?;:\"'").strip()
+
+
+def _bind_alarm(tool):
+    hour = _find_prop(tool, "integer", ("hour",))
+    minute = _find_prop(tool, "integer", ("minute",))
+    return {"hour": hour, "minute": minute} if hour and minute else None
+
+
+def _bind_timer(tool):
+    props = [k for k, v in _props(tool).items() if v.get("type") == "integer"]
+    if len(props) != 1 or not _tool_mentions(tool, ("timer", "countdown")):
+        return None
+    return {"amount": props[0]}
+
+
+def _bind_weather(tool):
+    loc = _find_prop(tool, "string", ("location", "city", "place"))
+    return {"location": loc} if loc and _tool_mentions(tool, ("weather", "forecast")) else None
+
+
+def _bind_message(tool):
+    to = _find_prop(tool, "string", ("recipient", "contact", "to"))
+    body = _find_prop(tool, "string", ("message", "text", "body", "content"))
+    return {"recipient": to, "message": body} if to and body and to != body else None
+
+
+def _bind_search(tool):
+    query = _find_prop(tool, "string", ("query", "name"))
+    return {"query": query} if query and _tool_mentions(tool, ("contact",)) else None
+
+
+def _bind_music(tool):
+    song = _find_prop(tool, "string", ("song", "track", "playlist", "music"))
+    return {"song": song} if song else None
+
+
+def _bind_reminder(tool):
+    title = _find_prop(tool, "string", ("title", "task", "text"))
+    when = _find_prop(tool, "string", ("time", "when"))
+    return {"title": title, "time": when} if title and when and _tool_mentions(tool, ("remind",)) else None
+
+
+def _extract_alarm(m, b):
+    clock = _clock(m)
+    if clock is None:
+        return None
+    return {b["hour"]: _to_24h(clock[0], m.group("ampm")), b["minute"]: clock[1]}
+
+
+def _extract_weather(m, b):
+    location = _entity(m.group("loc"))
+    return {b["location"]: location} if location else None
+
+
+def _extract_timer(m, b):
+    unit = m.group("unit").lower()
+    # Only answer when the request's unit is the one the schema takes (e.g. "minutes")
+    if not b["amount"].lower().startswith(unit[:3]):
+        return None
+    amount = int(m.group("amount"))
+    return {b["amount"]: amount} if amount > 0 else None
+
+
+def _extract_music(m, b):
+    song = _entity(m.group("song"))
+    if song is None or set(_TOKEN_RE.findall(song.lower())) & _NON_MUSIC_WORDS:
+        return None     # "play it again", "play the game with me"
+    if m.group("some") and song.lower().endswith(" music"):
+        song = song[: -len(" music")]      # "some jazz music" -> "jazz"
+    return {b["song"]: song}
+
+
+def _extract_search(m, b):
+    query = _entity(m.group("q"))
+    return {b["query"]: query} if query else None
+
+
+def _extract_reminder(m, b):
+    if _clock(m) is None:
+        return None     # "at 5": AM or PM?
+    title = _clean(m.group("todo") or m.group("about"))
+    return {b["title"]: title, b["time"]: _clock_string(m)}
+
+
+_FAST_PATH_RULES = [
+    ("alarm", _bind_alarm, _fp_grammar(
+        rf"(?:set (?:an |my |the )?alarm (?:for|at)|wake me(?: up)? at) {_TIME}"), _extract_alarm),
+    ("timer", _bind_timer, _fp_grammar(
+        r"set (?:a |an )?(?:timer for (?P<amount>\d+) (?P<unit>minutes?|mins?|seconds?|secs?|hours?)"
+        r"|(?P<amount2>\d+)[ -](?P<unit2>minute|second|hour) timer)"),
+     lambda m, b: _extract_timer(_TimerMatch(m), b)),
+    ("weather", _bind_weather, _fp_grammar(
+        r"(?:what(?:'s| is)|how(?:'s| is)|check|get|tell me)(?: the)? weather(?: like)? (?:in|for|at) (?P<loc>[^,;]+)"),
+     _extract_weather),
+    ("message", _bind_message, _fp_grammar(
+        rf"(?:send (?:a )?(?:message|text) to|text|message|send) {_NAME}(?: an? (?:message|text))?"
+        r" (?:saying|that says|to say) (?P<msg>.+)"),
+     lambda m, b: {b["recipient"]: m.group("name"), b["message"]: _clean(m.group("msg"))}),
+    ("search", _bind_search, _fp_grammar(
+        r"(?:find|look up|search for|search) (?P<q>[^,;]+?) in (?:my )?contacts"),
+     _extract_search),
+    ("music", _bind_music, _fp_grammar(r"play (?P<some>some )?(?P<song>[^,;]+)"), _extract_music),
+    ("reminder", _bind_reminder, _fp_grammar(
+        rf"remind me (?:to (?P<todo>.+?)|about (?:the )?(?P<about>.+?)) at {_TIME}"), _extract_reminder),
+]
+
+
+class _TimerMatch:
+    """Folds the two timer phrasings ("timer for 5 minutes" / "5 minute timer") into one view."""
+
+    def __init__(self, m):
+        self._m = m
+
+    def group(self, name):
+        return self._m.group(name) or self._m.group(name + "2")
+
+
+# A second action after a separator ("..., and check the weather") means more than one intent
+_INTENT_VERBS = r"(?P<verb>set|send|check|play|find|remind|text|get|search|look|wake|message|call|tell)\b"
+_MULTI_INTENT_RE = re.compile(
+    r"(?:,|;|\band\b|\bthen\b|\balso\b|\bplus\b)\s+(?:then\s+|also\s+)?" + _INTENT_VERBS,
+    re.IGNORECASE,
+)
+
+
+def _fast_path_bindings(tools):
+    return [
+        (tool["name"], rule, binding, grammar, extract)
+        for tool in tools
+        for rule, bind, grammar, extract in _FAST_PATH_RULES
+        for binding in [bind(tool)] if binding is not None
+    ]
+
+
+def _fast_path(messages, tools):
+    """Return a single unambiguous (rule, call) parsed from the utterance, or None."""
+    user = [m["content"] for m in messages if m["role"] == "user"]
+    if len(user) != 1:
+        return None
+    text = _clean(" ".join(user[0].split()))
+    if _MULTI_INTENT_RE.search(text):
+        return None
+    found = []
+    for tool_name, rule, binding, grammar, extract in compile_tools(tools).derived("fast_path", _fast_path_bindings):
+        m = grammar.fullmatch(text)
+        if m is None:
+            continue
+        args = extract(m, binding)
+        if args is None:
+            continue
+        found.append((rule, {"name": tool_name, "arguments": args}))
+        if len(found) > 1:
+            return None     # two tools (or rules) claim it: let the model decide
+    return found[0] if found else None
+
+
+def _fast_path_result(messages, tools, start):
+    if not _FAST_PATH_ENABLED:
+        return None
+    hit = _fast_path(messages, tools)
+    clauses = []
+    if hit is not None:
+        hits = [hit]
+    else:
+        # A compound request is still rule-answerable when every clause is
+        clauses = _split_intents(messages, tools)
+        hits = []
+        for clause in clauses:
+            hit = _fast_path(_clause_messages(clause), tools)
+            if hit is None:
+                return None
+            hits.append(hit)
+        if not hits:
+            return None
+    result = {
+        "function_calls": _dedupe_calls([call for _, call in hits]),
+        "total_time_ms": (time.time() - start) * 1000,
+        "confidence": 1.0,
+        "source": "on-device",
+        "complexity": _classify_complexity(messages, tools),
+        "fast_path": "+".join(rule for rule, _ in hits),
+    }
+    if clauses:
+        result["split"] = len(clauses)
+    return result
+
+
+# --- Multi-intent splitter ---
+# FunctionGemma is reliable at one call and poor at several, so a compound
+# request is split at the separators above into single-intent clauses. Each
+# clause gets only the tools it talks about and runs as its own on-device pass;
+# the clauses run in parallel and their calls are merged.
+_SPLIT_CONFIG = {
+    "enabled": os.environ.get("MINGLE_SPLIT_INTENTS", "1") != "0",
+    "max_clauses": int(os.environ.get("MINGLE_SPLIT_MAX_CLAUSES", 4)),
+    "tools_per_clause": int(os.environ.get("MINGLE_SPLIT_TOOLS_PER_CLAUSE", 2)),
+}
+
+_PRONOUN_RE = re.compile(r"\b(?:him|her|them)\b", re.IGNORECASE)
+_CONTACT_NAME_RE = re.compile(
+    r"\b(?:[Tt]ext|[Mm]essage|[Cc]all|[Ff]ind|[Ll]ook up|[Ss]earch for|[Tt]ell|to|with)\s+([A-Z][\w'-]*)")
+# A clause is an intent only if it opens with an imperative verb whose phrase
+# (the verb and the next few words) points at a tool in the catalog
+_IMPERATIVE_RE = re.compile(_POLITE + _INTENT_VERBS, re.IGNORECASE)
+_VERB_PHRASE_WORDS = 4
+# Quoted text or "Label: value" fields (Bio:, Skills:, a transcript) are data
+# for the model, not instructions to split on
+_TEMPLATE_CONTEXT_RE = re.compile(r"[\"\u201c\u201d]|(?:^|[\s(])[A-Za-z][\w/-]*(?: [\w/-]+){0,3}:\s")
+# A message body runs on after these; "... saying I will set the table and get
+# groceries" only splits if the rest names a tool through its object, not its verb
+_MESSAGE_BODY_RE = re.compile(r"\b(?:saying|says|to say)\b", re.IGNORECASE)
+
+
+def _clause_messages(clause):
+    return [{"role": "user", "content": clause}]
+
+
+def _targets_tool(clause, index):
+    m = _IMPERATIVE_RE.match(clause)
+    if m is None:
+        return False
+    phrase = " ".join(clause[m.start("verb"):].split()[:_VERB_PHRASE_WORDS + 1])
+    return max(index.scores(phrase), default=0) > 0
+
+
+def _has_own_target(clause, index):
+    """The clause's object (plus the verb's intent hint, not the verb) points at a tool."""
+    m = _IMPERATIVE_RE.match(clause)
+    if m is None:
+        return False
+    words = clause[m.end("verb"):].split()[:_VERB_PHRASE_WORDS] + [_INTENT_HINTS.get(m["verb"].lower(), "")]
+    return max(index.scores(" ".join(words)), default=0) > 0
+
+
+def _intent_clauses(messages, tools):
+    """Single-intent clauses of a compound user turn with pronouns resolved; [] if not compound."""
+    user = [m["content"] for m in messages if m["role"] == "user"]
+    if len(user) != 1 or _TEMPLATE_CONTEXT_RE.search(user[0]):
+        return []
+    text = " ".join(user[0].split())
+    bounds = list(_MULTI_INTENT_RE.finditer(text))
+    if not bounds:
+        return []
+    index = compile_tools(tools).derived("tool_index", ToolIndex)
+    spans = []
+    for begin, end in zip([0] + [m.start("verb") for m in bounds], [m.start() for m in bounds] + [len(text)]):
+        if spans and _MESSAGE_BODY_RE.search(text, *spans[-1]) and not _has_own_target(_clean(text[begin:end]), index):
+            spans[-1][1] = end      # still inside the message body
+        else:
+            spans.append([begin, end])
+    if len(spans) < 2:
+        return []
+    clauses, name = [], None
+    for begin, end in spans:
+        clause = _clean(text[begin:end])
+        if not _targets_tool(clause, index):
+            return []   # "I love to build things, find great people": not a list of commands
+        if name:
+            clause = _PRONOUN_RE.sub(name, clause)     # "send him a message" -> "send Tom a message"
+        names = _CONTACT_NAME_RE.findall(clause)
+        if names:
+            name = names[-1]
+        clauses.append(clause)
+    return clauses
+
+
+def _split_intents(messages, tools):
+    """Clauses to run as separate passes; [] when splitting is off or the turn is not compound."""
+    if not _SPLIT_CONFIG["enabled"]:
+        return []
+    clauses = _intent_clauses(messages, tools)
+    return clauses if len(clauses) <= _SPLIT_CONFIG["max_clauses"] else []
+
+
+def _clause_tools(clause, tools, k):
+    """The ``k`` tools that best match the clause ([] if none match)."""
+    return compile_tools(tools).derived("tool_index", ToolIndex).top_k(clause, k)
+
+
+def _dedupe_calls(calls):
+    seen, unique = set(), []
+    for call in calls:
+        key = (call["name"], json.dumps(call.get("arguments", {}), sort_keys=True))
+        if key not in seen:
+            seen.add(key)
+            unique.append(call)
+    return unique
+
+
+_CLAUSE_WORKERS = int(os.environ.get("MINGLE_SPLIT_WORKERS", 8))
+
+
+def _new_clause_executor():
+    return ThreadPoolExecutor(max_workers=_CLAUSE_WORKERS, thread_name_prefix="mingle-clause")
+
+
+_clause_executor = _new_clause_executor()
+
+
+# --- Argument validation ---
+# Local calls are checked and repaired against the tool JSON schemas before the
+# accept decision: "10" or "10 AM" in an integer hour becomes 10, "3pm" in a
+# time string becomes "3:00 PM", near-miss enum values snap to the allowed one.
+# Numbers must be in range (the schema's minimum/maximum, else _FIELD_BOUNDS);
+# a value whose digits would have to be dug out of other text is invalid.
+# A schema-valid result is accepted slightly below the tier's default threshold
+# (never below one the caller passed explicitly); a call that cannot be
+# repaired (unknown tool, missing required argument) is rejected however
+# confident the model was.
+_VALIDATION_CONFIG = {
+    "enabled": os.environ.get("MINGLE_VALIDATE_ARGS", "1") != "0",
+    "margin": float(os.environ.get("MINGLE_VALIDATED_MARGIN", 0.05)),
+}
+
+_NUMBER_RE = re.compile(r"[-+]?\d+(?:\.\d+)?")
+_CLOCK_RE = re.compile(rf"{_TIME}", re.IGNORECASE)
+_WORD_NUMBERS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+    "fifteen": 15, "twenty": 20, "thirty": 30, "forty-five": 45, "sixty": 60,
+}
+# Inclusive ranges for well-known numeric arguments the schemas leave open
+_FIELD_BOUNDS = {"hour": (0, 23), "minute": (0, 59), "minutes": (1, 1440)}
+_TRUE_WORDS = {"true", "yes", "on", "1"}
+_FALSE_WORDS = {"false", "no", "off", "0"}
+
+
+class _Invalid(ValueError):
+    """An argument value that cannot be coerced to its schema."""
+
+
+def _coerce_integer(value, key):
+    if isinstance(value, bool):
+        raise _Invalid(f"{key}: boolean for integer")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in _WORD_NUMBERS:
+            return _WORD_NUMBERS[text]
+        clock = _CLOCK_RE.fullmatch(text)
+        if clock and "hour" in key.lower():
+            return _to_24h(clock["hour"], clock["ampm"])    # "10 AM" -> 10, "7 pm" -> 19
+        if _NUMBER_RE.fullmatch(text) and float(text).is_integer():
+            return int(float(text))
+    raise _Invalid(f"{key}: {value!r} is not an integer")
+
+
+def _coerce_number(value, key):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and _NUMBER_RE.fullmatch(value.strip()):
+        return float(value)
+    raise _Invalid(f"{key}: {value!r} is not a number")
+
+
+def _check_bounds(value, key, spec):
+    low, high = _FIELD_BOUNDS.get(key.lower(), (None, None))
+    low, high = spec.get("minimum", low), spec.get("maximum", high)
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise _Invalid(f"{key}: {value!r} out of range")
+    return value
+
+
+def _coerce_boolean(value, key):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE_WORDS:
+        return True
+    if text in _FALSE_WORDS:
+        return False
+    raise _Invalid(f"{key}: {value!r} is not a boolean")
+
+
+def _coerce_string(value, key):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        raise _Invalid(f"{key}: {value!r} is not a string")
+    value = value.strip()
+    if key.lower() in ("time", "when") or key.lower().endswith("_time"):
+        clock = _CLOCK_RE.fullmatch(value)
+        if clock and (clock["minute"] or clock["ampm"]):
+            value = _clock_string(clock)
+    return value
+
+
+def _snap_enum(value, allowed, key):
+    if value in allowed:
+        return value
+    lowered = {str(a).lower(): a for a in allowed}
+    if str(value).lower() in lowered:
+        return lowered[str(value).lower()]
+    close = difflib.get_close_matches(str(value).lower(), list(lowered), n=1, cutoff=0.6)
+    if close:
+        return lowered[close[0]]
+    raise _Invalid(f"{key}: {value!r} not in {allowed}")
+
+
+_COERCERS = {"integer": _coerce_integer, "number": _coerce_number, "boolean": _coerce_boolean}
+_CONTAINER_TYPES = {"array": list, "object": dict}
+
+
+def _coerce(value, key, spec):
+    kind = spec.get("type", "string")
+    if kind in _COERCERS:
+        value = _COERCERS[kind](value, key)
+        if kind != "boolean":
+            value = _check_bounds(value, key, spec)
+    elif kind in _CONTAINER_TYPES:
+        if not isinstance(value, _CONTAINER_TYPES[kind]):
+            raise _Invalid(f"{key}: {value!r} is not an {kind}")
+    else:
+        value = _coerce_string(value, key)
+    if "enum" in spec:
+        value = _snap_enum(value, spec["enum"], key)
+    return value
+
+
+def _build_schemas(tools):
+    return {t["name"]: (_props(t), set(t.get("parameters", {}).get("required", []))) for t in tools}
+
+
+def _validate_call(call, schemas):
+    """Return (repaired call, "ok" | "repaired"), or (call, "invalid")."""
+    name = call.get("name")
+    if name not in schemas:
+        lowered = {n.lower(): n for n in schemas}
+        close = difflib.get_close_matches(str(name).lower(), list(lowered), n=1, cutoff=0.8)
+        if not close:
+            return call, "invalid"
+        name = lowered[close[0]]
+    props, required = schemas[name]
+    args = call.get("arguments") or {}
+    if not isinstance(args, dict):
+        return call, "invalid"
+    fixed = {}
+    try:
+        for key, value in args.items():
+            if key in props:
+                fixed[key] = _coerce(value, key, props[key])
+        # "hour": "7:30 AM" with no minute argument carries the minute too
+        minute = _find_prop({"parameters": {"properties": props}}, "integer", ("minute",))
+        for key, value in args.items():
+            if minute and minute not in fixed and isinstance(value, str) and "hour" in key.lower():
+                clock = _CLOCK_RE.fullmatch(value.strip())
+                if clock and clock["minute"]:
+                    fixed[minute] = _check_bounds(int(clock["minute"]), minute, props[minute])
+    except _Invalid:
+        return call, "invalid"
+    if not required <= fixed.keys():
+        return call, "invalid"
+    repaired = {"name": name, "arguments": fixed}
+    return repaired, "ok" if repaired == {"name": call.get("name"), "arguments": args} else "repaired"
+
+
+def validate_calls(calls, tools):
+    """Check and coerce calls against the tool schemas.
+
+    Returns (calls, status) where status is "ok", "repaired" or "invalid"; on
+    "invalid" the calls come back unchanged.
+    """
+    schemas = compile_tools(tools).derived("schemas", _build_schemas)
+    out, status = [], "ok"
+    for call in calls:
+        fixed, call_status = _validate_call(call, schemas)
+        if call_status == "invalid":
+            return calls, "invalid"
+        if call_status == "repaired":
+            status = "repaired"
+        out.append(fixed)
+    return out, status
+
+
+def _native_threshold(threshold, relax=True):
+    """Threshold for the native Cactus gate: validated results may pass a little below the tier's.
+
+    ``relax`` is False when the caller chose the threshold, which is then a hard floor.
+    """
+    return threshold - _VALIDATION_CONFIG["margin"] if _VALIDATION_CONFIG["enabled"] and relax else threshold
+
+
+# --- Tolerant output parsing ---
+# cactus_complete occasionally returns JSON that json.loads rejects: cut off at
+# max_tokens, a trailing comma, an unterminated string. Rather than discard the
+# local pass, repair it (or salvage whatever calls closed) and record how in
+# raw["repair"]; confidence and schema validation then decide as usual.
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_CALLS_KEY_RE = re.compile(r'"function_calls"\s*:\s*\[')
+_CONFIDENCE_RE = re.compile(r'"confidence"\s*:\s*([0-9.eE+-]+)')
+
+
+def _scan(text):
+    """Walk JSON text; return (stack of open brackets, whether it ends inside a string)."""
+    stack, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]" and stack:
+            stack.pop()
+    return stack, in_string
+
+
+def _close_truncated(text):
+    """Terminate an open string, drop a dangling separator and close open brackets."""
+    stack, in_string = _scan(text)
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(":"):
+        text += " null"
+    text = text.rstrip(",")
+    return text + "".join("}" if b == "{" else "]" for b in reversed(stack)), in_string
+
+
+def _complete_objects(text):
+    """Top-level {...} objects in ``text`` that closed, in order."""
+    objects, depth, start, in_string, escaped = [], 0, None, False, False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                objects.append(text[start:i + 1])
+        elif ch == "]" and depth == 0:
+            break       # end of the calls array
+    return objects
+
+
+def _salvage_calls(text):
+    m = _CALLS_KEY_RE.search(text)
+    if m is None:
+        return []
+    calls = []
+    for obj in _complete_objects(text[m.end():]):
+        try:
+            call = json.loads(_TRAILING_COMMA_RE.sub(r"\1", obj))
+        except json.JSONDecodeError:
+            continue
+        if isinstance(call, dict) and "name" in call:
+            calls.append(call)
+    return calls
+
+
+# Numeric fields of the response; a repaired value (e.g. a truncated
+# "total_time_ms": closed as null) is not trusted and reads as 0. An
+# unreadable cloud_handoff reads as a handoff.
+_METADATA_FIELDS = (
+    "total_time_ms", "time_to_first_token_ms", "decode_tps",
+    "prefill_tokens", "decode_tokens", "total_tokens",
+)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_metadata(raw):
+    if not _is_number(raw.get("confidence")):
+        raw.pop("confidence", None)
+    for key in _METADATA_FIELDS:
+        if key in raw and not _is_number(raw[key]):
+            raw[key] = 0
+    if not isinstance(raw.get("cloud_handoff", False), bool):
+        raw["cloud_handoff"] = True
+
+
+def _parse_raw(raw_str):
+    """json.loads with repairs. Returns a dict; ``repair`` names the fix when one was needed.
+
+    Kinds, tried in order: "trailing_comma", "truncated" / "unbalanced_quote"
+    (closed brackets, terminated string) and "partial_calls" (only the calls
+    that closed, plus the confidence if it made it out).
+    """
+    try:
+        return json.loads(raw_str)
+    except (TypeError, json.JSONDecodeError):
+        pass
+    if not isinstance(raw_str, str) or not raw_str.strip():
+        return {}
+    text = raw_str.strip()
+    candidates = []
+    uncomma = _TRAILING_COMMA_RE.sub(r"\1", text)
+    if uncomma != text:
+        candidates.append((uncomma, "trailing_comma"))
+    closed, had_open_string = _close_truncated(uncomma)
+    candidates.append((_TRAILING_COMMA_RE.sub(r"\1", closed), "unbalanced_quote" if had_open_string else "truncated"))
+    for candidate, kind in candidates:
+        try:
+            raw = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(raw, dict):
+            if kind != "trailing_comma":
+                # Closing brackets completes a cut-off call too; keep only calls that closed on their own
+                raw["function_calls"] = _salvage_calls(uncomma)
+            _check_metadata(raw)
+            raw["repair"] = kind
+            return raw
+    calls = _salvage_calls(text)
+    if not calls:
+        return {"repair": "unrecoverable"}
+    confidence = _CONFIDENCE_RE.search(text)
+    raw = {"function_calls": calls, "repair": "partial_calls"}
+    if confidence:
+        try:
+            raw["confidence"] = float(confidence.group(1))
+        except ValueError:
+            pass
+    return raw
+
+
+# --- Streaming decode ---
+# With a token callback the local pass stops itself as soon as the number of
+# calls the request asks for have closed and validated, instead of decoding on
+# to the stop sequence or max_tokens. Cactus only reports confidence once the
+# decode is over, so the mid-decode bail-out is structural: no call opened
+# within stall_tokens, or a closed call names an unknown tool or is missing a
+# required argument. Either one hands off to the cloud straight away.
+_STREAM_CONFIG = {
+    "enabled": os.environ.get("MINGLE_STREAM_DECODE", "1") != "0",
+    "stall_tokens": int(os.environ.get("MINGLE_STREAM_STALL_TOKENS", 24)),
+}
+
+# FunctionGemma emits call:name{key:<escape>value<escape>,...}
+_FG_CALL_RE = re.compile(r"call:(?P<name>[\w.-]+)\s*(?P<args>\{.*\})\s*$", re.DOTALL)
+_FG_ARG_RE = re.compile(r"(\w+):(?:<escape>(.*?)<escape>|([^,}]*))", re.DOTALL)
+_ESCAPE = "<escape>"
+
+
+def _expected_call_count(messages, tools):
+    """Calls a compound request should produce, or None when the splitter found no count."""
+    return len(_intent_clauses(messages, tools)) or None
+
+
+def _fg_value(value):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value.strip()
+
+
+def _parse_call(segment):
+    """One call from a closed top-level {...} segment, JSON or FunctionGemma syntax."""
+    text = segment.lstrip(" \t\n,[")
+    try:
+        obj = json.loads(text)
+        if isinstance(obj, dict) and "name" in obj:
+            return {"name": obj["name"], "arguments": obj.get("arguments") or {}}
+    except json.JSONDecodeError:
+        pass
+    m = _FG_CALL_RE.search(text)
+    if m is None:
+        return None
+    args = {
+        a[1]: a[2] if a[2] is not None else _fg_value(a[3])
+        for a in _FG_ARG_RE.finditer(m["args"][1:-1])
+    }
+    return {"name": m["name"], "arguments": args}
+
+
+class _CallStream:
+    """Incremental parser over decoded tokens that decides when to stop.
+
+    Tracks brace depth outside string literals (JSON quotes or <escape>
+    pairs); each time a call's object closes, the text since the previous
+    call is parsed as a call and checked against the tool schemas. Calls are
+    top-level objects (FunctionGemma syntax, a bare JSON list), or one level
+    down inside a JSON {"function_calls": [...]} wrapper.
+    ``stop_reason`` is "complete", "no_call" or "invalid_call" once ``feed``
+    has returned True. With ``expected`` None the stream never stops on the
+    call count: a single-looking prompt may still ask for several calls.
+    """
+
+    def __init__(self, tools, expected, stall_tokens):
+        self._schemas = compile_tools(tools).derived("schemas", _build_schemas)
+        self.expected = expected
+        self.stall_tokens = stall_tokens
+        self.text = ""
+        self.tokens = 0
+        self.calls = []
+        self.stop_reason = None
+        self._pos = 0
+        self._start = 0     # where the current call's text begins
+        self._depth = 0
+        self._call_depth = 1    # brace depth of a call object; 2 inside the JSON wrapper
+        self._opened = False
+        self._in_quote = False
+        self._in_escape = False
+
+    def feed(self, token):
+        """Consume one token; return True when decoding should stop."""
+        if self.stop_reason is not None:
+            return True
+        self.tokens += 1
+        self.text += token
+        text, i = self.text, self._pos
+        while i < len(text):
+            if text.startswith(_ESCAPE, i):
+                self._in_escape = not self._in_escape
+                i += len(_ESCAPE)
+                continue
+            ch = text[i]
+            if self._in_quote:
+                if ch == "\\":
+                    i += 2
+                    continue
+                if ch == '"':
+                    self._in_quote = False
+            elif not self._in_escape:
+                if ch == '"':
+                    self._in_quote = True
+                elif ch == "{":
+                    self._depth += 1
+                    self._opened = True
+                    if self._depth == 2 and self._call_depth == 1 and _CALLS_KEY_RE.search(text, self._start, i):
+                        self._call_depth = 2
+                        self._start = i
+                elif ch == "}" and self._depth:
+                    self._depth -= 1
+                    if self._depth == self._call_depth - 1:
+                        if self._close(text[self._start:i + 1]):
+                            self._pos = i + 1
+                            return True
+                        self._start = i + 1
+            i += 1
+        self._pos = i
+        if not self._opened and self.tokens >= self.stall_tokens:
+            self.stop_reason = "no_call"
+            return True
+        return False
+
+    def _close(self, segment):
+        call = _parse_call(segment)
+        status = "invalid" if call is None else None
+        if call is not None:
+            call, status = _validate_call(call, self._schemas)
+        if status == "invalid":
+            self.stop_reason = "invalid_call"
+            return True
+        self.calls.append(call)
+        if self.expected is not None and len(self.calls) >= self.expected:
+            self.stop_reason = "complete"
+            return True
+        return False
+
+
+def _apply_early_exit(raw, stream):
+    """Fold the stream's stop decision into the raw cactus_complete response."""
+    if stream.stop_reason is None:
+        return raw
+    raw["early_exit"] = stream.stop_reason
+    if stream.stop_reason == "complete":
+        if not raw.get("function_calls"):
+            raw["function_calls"] = stream.calls   # stopped before the native parser saw the end
+    else:
+        raw["cloud_handoff"] = True
+        raw["function_calls"] = []
+    return raw
+
 
 def generate_cactus(messages, tools):
     """Run function calling on-device via FunctionGemma + Cactus."""
@@ -95,40 +1575,223 @@ def generate_cactus(messages, tools):
     }
 
 
-def generate_cloud(messages, tools):
-    """Run function calling via Gemini Cloud API."""
-    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+# --- Cloud client ---
+# One process-wide genai client so every fallback reuses pooled keep-alive
+# connections instead of paying DNS + TCP + TLS setup per call.
+_CLOUD_CONFIG = {
+    "model": os.environ.get("GEMINI_MODEL", "gemini-2.0-flash"),
+    "base_url": os.environ.get("GEMINI_BASE_URL"),   # e.g. the fake server in sim_backends.py
+    "timeout_s": float(os.environ.get("GEMINI_TIMEOUT_S", 30)),
+    "max_retries": int(os.environ.get("GEMINI_MAX_RETRIES", 2)),
+    "backoff_base_s": float(os.environ.get("GEMINI_BACKOFF_BASE_S", 0.25)),
+    "backoff_max_s": float(os.environ.get("GEMINI_BACKOFF_MAX_S", 4.0)),
+    "max_connections": int(os.environ.get("GEMINI_MAX_CONNECTIONS", 64)),
+    "keepalive_s": float(os.environ.get("GEMINI_KEEPALIVE_S", 60)),
+}
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_CONNECT_EVENTS = ("connection.connect_tcp.complete", "connection.start_tls.complete")
+
+_cloud_client = None
+_cloud_client_pid = None
+_cloud_client_lock = threading.Lock()
+# The aio transport is bound to the event loop that first uses it: loop -> (client, closer)
+_async_cloud_clients = {}
+
+# Per-call timing record; a ContextVar so concurrent threads/tasks don't mix
+_cloud_timing = contextvars.ContextVar("cloud_timing", default=None)
+
+
+def _since_attempt_ms(timing):
+    return (time.time() - timing["attempt_start"]) * 1000
+
+
+def _mark_event(name):
+    timing = _cloud_timing.get()
+    if timing is not None and name in _CONNECT_EVENTS:
+        timing["connect_ms"] = _since_attempt_ms(timing)
+
+
+def _mark_ttfb():
+    timing = _cloud_timing.get()
+    if timing is not None and timing["ttfb_ms"] is None:
+        timing["ttfb_ms"] = _since_attempt_ms(timing)
+
+
+# httpx hooks: attach an httpcore trace to each request so we can see whether
+# a fresh connection was opened, and stamp TTFB when response headers arrive.
+def _trace(name, info):
+    _mark_event(name)
+
+
+async def _atrace(name, info):
+    _mark_event(name)
+
+
+def _on_request(request):
+    request.extensions["trace"] = _trace
+
+
+async def _aon_request(request):
+    request.extensions["trace"] = _atrace
+
+
+def _on_response(response):
+    _mark_ttfb()
+
+
+async def _aon_response(response):
+    _mark_ttfb()
+
+
+def _new_cloud_client():
+    limits = httpx.Limits(
+        max_connections=_CLOUD_CONFIG["max_connections"],
+        max_keepalive_connections=_CLOUD_CONFIG["max_connections"],
+        keepalive_expiry=_CLOUD_CONFIG["keepalive_s"],
+    )
+    return genai.Client(
+        api_key=os.environ.get("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(
+            base_url=_CLOUD_CONFIG["base_url"],
+            timeout=int(_CLOUD_CONFIG["timeout_s"] * 1000),
+            client_args={
+                "limits": limits,
+                "event_hooks": {"request": [_on_request], "response": [_on_response]},
+            },
+            async_client_args={
+                "limits": limits,
+                "event_hooks": {"request": [_aon_request], "response": [_aon_response]},
+            },
+        ),
+    )
+
+
+def _get_cloud_client():
+    """Process-wide genai client for sync calls; rebuilt after fork so workers never share sockets."""
+    global _cloud_client, _cloud_client_pid
+    pid = os.getpid()
+    if _cloud_client is not None and _cloud_client_pid == pid:
+        return _cloud_client
+    with _cloud_client_lock:
+        if _cloud_client is None or _cloud_client_pid != pid:
+            _cloud_client = _new_cloud_client()
+            _cloud_client_pid = pid
+    return _cloud_client
+
+
+async def _close_with_loop(client):
+    # Parked on its loop; asyncio.run finalizes async generators before closing
+    # the loop, so the aio transport is closed on the loop that owns it
+    try:
+        yield
+    finally:
+        await client.aio.aclose()
+
+
+async def _get_async_cloud_client():
+    """genai client for async calls on the running event loop; each loop gets its own."""
+    loop = asyncio.get_running_loop()
+    entry = _async_cloud_clients.get(loop)
+    if entry is None:
+        client = _new_cloud_client()
+        closer = _close_with_loop(client)
+        await closer.asend(None)
+        with _cloud_client_lock:
+            for stale in [l for l in _async_cloud_clients if l.is_closed()]:
+                del _async_cloud_clients[stale]
+            entry = _async_cloud_clients[loop] = (client, closer)
+    return entry[0]
+
+
+def _reset_after_fork():
+    # Parent's connections and executor threads do not survive into the child
+    global _cloud_client, _cloud_client_pid, _cloud_client_lock, _cloud_executor, _clause_executor
+    _cloud_client = None
+    _cloud_client_pid = None
+    _cloud_client_lock = threading.Lock()
+    _async_cloud_clients.clear()
+    _cloud_executor = _new_cloud_executor()
+    _clause_executor = _new_clause_executor()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _is_retryable(exc):
+    if isinstance(exc, httpx.TransportError):
+        return True
+    return isinstance(exc, genai_errors.APIError) and getattr(exc, "code", None) in _RETRYABLE_STATUS
+
+
+def _retry_delay(attempt):
+    # Full jitter: spreads retries from concurrent callers instead of syncing them up
+    cap = min(_CLOUD_CONFIG["backoff_max_s"], _CLOUD_CONFIG["backoff_base_s"] * (2 ** attempt))
+    return random.uniform(0, cap)
+
 
-    gemini_tools = [
+def _start_timing():
+    now = time.time()
+    return {"start": now, "attempt_start": now, "connect_ms": 0.0, "ttfb_ms": None, "attempts": 0}
+
+
+def _begin_attempt(timing):
+    timing["attempt_start"] = time.time()
+    timing["connect_ms"] = 0.0
+    timing["ttfb_ms"] = None
+    timing["attempts"] += 1
+
+
+def _timing_summary(timing):
+    total_ms = (time.time() - timing["start"]) * 1000
+    # connect/ttfb describe the final attempt; total spans every attempt
+    return {
+        "connect_ms": timing["connect_ms"],     # 0 when a pooled connection was reused
+        "ttfb_ms": timing["ttfb_ms"] if timing["ttfb_ms"] is not None else _since_attempt_ms(timing),
+        "total_ms": total_ms,                   # includes retries and backoff
+        "attempts": timing["attempts"],
+    }
+
+
+def _gemini_schema(spec):
+    """Convert a JSON-schema dict to types.Schema, recursing into objects and arrays."""
+    kind = spec.get("type", "string")
+    if isinstance(kind, list):      # e.g. ["string", "null"]
+        kind = next((k for k in kind if k != "null"), "string")
+    kind = kind.upper()
+    kwargs = {"type": kind}
+    if spec.get("description"):
+        kwargs["description"] = spec["description"]
+    if spec.get("enum"):
+        kwargs["enum"] = [str(v) for v in spec["enum"]]
+    if kind == "OBJECT":
+        if spec.get("properties"):
+            kwargs["properties"] = {k: _gemini_schema(v) for k, v in spec["properties"].items()}
+        if spec.get("required"):
+            kwargs["required"] = list(spec["required"])
+    elif kind == "ARRAY":
+        kwargs["items"] = _gemini_schema(spec.get("items") or {"type": "string"})
+    return types.Schema(**kwargs)
+
+
+def _gemini_tools(tools):
+    return [
         types.Tool(function_declarations=[
             types.FunctionDeclaration(
                 name=t["name"],
-                description=t["description"],
-                parameters=types.Schema(
-                    type="OBJECT",
-                    properties={
-                        k: types.Schema(type=v["type"].upper(), description=v.get("description", ""))
-                        for k, v in t["parameters"]["properties"].items()
-                    },
-                    required=t["parameters"].get("required", []),
+                description=t.get("description", ""),
+                # Gemini rejects OBJECT schemas with no properties; omit parameters instead
+                parameters=(
+                    _gemini_schema(t["parameters"])
+                    if t.get("parameters", {}).get("properties") else None
                 ),
             )
             for t in tools
         ])
     ]
 
-    contents = [m["content"] for m in messages if m["role"] == "user"]
-
-    start_time = time.time()
-
-    gemini_response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=contents,
-        config=types.GenerateContentConfig(tools=gemini_tools),
-    )
-
-    total_time_ms = (time.time() - start_time) * 1000
 
+def _gemini_function_calls(gemini_response):
     function_calls = []
     for candidate in gemini_response.candidates:
         for part in candidate.content.parts:
@@ -137,71 +1800,366 @@ def generate_cloud(messages, tools):
                     "name": part.function_call.name,
                     "arguments": dict(part.function_call.args),
                 })
+    return function_calls
+
+
+def generate_cloud(messages, tools):
+    """Run function calling via Gemini Cloud API (pooled client, retries with jittered backoff)."""
+    client = _get_cloud_client()
+
+    contents = [m["content"] for m in messages if m["role"] == "user"]
+    config = compile_tools(tools).gemini_config
+
+    timing = _start_timing()
+    token = _cloud_timing.set(timing)
+    try:
+        for attempt in range(_CLOUD_CONFIG["max_retries"] + 1):
+            _begin_attempt(timing)
+            try:
+                gemini_response = client.models.generate_content(
+                    model=_CLOUD_CONFIG["model"],
+                    contents=contents,
+                    config=config,
+                )
+                break
+            except Exception as e:
+                if attempt >= _CLOUD_CONFIG["max_retries"] or not _is_retryable(e):
+                    raise
+                time.sleep(_retry_delay(attempt))
+    finally:
+        _cloud_timing.reset(token)
 
+    cloud_timing = _timing_summary(timing)
     return {
-        "function_calls": function_calls,
-        "total_time_ms": total_time_ms,
+        "function_calls": _gemini_function_calls(gemini_response),
+        "total_time_ms": cloud_timing["total_ms"],
+        "cloud_timing": cloud_timing,
     }
 
 
-def generate_hybrid(messages, tools, confidence_threshold=None):
-    """Hybrid inference: classify complexity, route to on-device or cloud.
+async def generate_cloud_async(messages, tools):
+    """Async variant of generate_cloud on the genai ``aio`` client."""
+    client = await _get_async_cloud_client()
 
-    Uses a model persistence singleton to avoid re-initialising Cactus on
-    every call (major latency improvement). Complexity-aware routing lowers
-    confidence thresholds for simple requests so more work stays on-device.
-    """
+    contents = [m["content"] for m in messages if m["role"] == "user"]
+    config = compile_tools(tools).gemini_config
+
+    timing = _start_timing()
+    token = _cloud_timing.set(timing)
+    try:
+        for attempt in range(_CLOUD_CONFIG["max_retries"] + 1):
+            _begin_attempt(timing)
+            try:
+                gemini_response = await client.aio.models.generate_content(
+                    model=_CLOUD_CONFIG["model"],
+                    contents=contents,
+                    config=config,
+                )
+                break
+            except Exception as e:
+                if attempt >= _CLOUD_CONFIG["max_retries"] or not _is_retryable(e):
+                    raise
+                await asyncio.sleep(_retry_delay(attempt))
+    finally:
+        _cloud_timing.reset(token)
+
+    cloud_timing = _timing_summary(timing)
+    return {
+        "function_calls": _gemini_function_calls(gemini_response),
+        "total_time_ms": cloud_timing["total_ms"],
+        "cloud_timing": cloud_timing,
+    }
+
+
+# --- Hybrid routing stages (shared by the sync and async entry points) ---
+
+def _cache_lookup(key):
+    start = time.time()
+    hit = _result_cache.get(key)
+    if hit is None:
+        return None
+    result = copy.deepcopy(hit)
+    result["cached_source"] = result["source"]
+    result["source"] = "cache"
+    result["total_time_ms"] = (time.time() - start) * 1000
+    return result
+
+
+def _cache_store(key, result):
+    if result.get("function_calls"):
+        _result_cache.put(key, copy.deepcopy(result))
+
+
+def _route_plan(messages, tools, confidence_threshold):
     complexity = _classify_complexity(messages, tools)
     cfg = _COMPLEXITY_CONFIG[complexity]
-
     # Use caller-supplied threshold if provided, otherwise use per-complexity default
     threshold = confidence_threshold if confidence_threshold is not None else cfg["confidence_threshold"]
+    p_fallback = _fallback_probability(messages, tools, complexity)
+    return complexity, cfg, threshold, p_fallback
 
-    model = _get_cactus_model()
 
-    # Pass all tools — tool_rag_top_k in cactus_complete handles native RAG filtering
-    cactus_tools = [{"type": "function", "function": t} for t in tools]
-
-    raw_str = cactus_complete(
-        model,
-        [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + messages,
-        tools=cactus_tools,
-        force_tools=True,
-        max_tokens=cfg["max_tokens"],
-        tool_rag_top_k=cfg["tool_rag_top_k"],      # native Cactus RAG tool filtering
-        confidence_threshold=threshold,             # native Cactus confidence gate
-        stop_sequences=["<|im_end|>", "<end_of_turn>"],
-    )
+def _run_local(messages, tools, cfg, threshold, relax=True):
+    """One on-device pass on a pooled handle. Returns (raw dict, ran_local)."""
+    # Large catalogs are narrowed by the tool index; tool_rag_top_k in cactus_complete filters the rest
+    tools = _select_tools(messages, tools)
+    if not tools:
+        # Nothing in the catalog matches: the model would only guess, so leave it to the cloud
+        return {}, False
+    cactus_tools = compile_tools(tools).cactus_tools
+    stream = None
+    options = {}
+    if _STREAM_CONFIG["enabled"]:
+        stream = _CallStream(tools, _expected_call_count(messages, tools), _STREAM_CONFIG["stall_tokens"])
 
     try:
-        raw = json.loads(raw_str)
-    except json.JSONDecodeError:
-        raw = {}
+        with _model_pool.borrow() as model:
+            if stream is not None:
+                def on_token(token, token_id, user_data):
+                    if isinstance(token, bytes):
+                        token = token.decode("utf-8", errors="ignore")
+                    if stream.stop_reason is None and stream.feed(token):
+                        cactus_stop(model)
+                options["callback"] = on_token
+            raw_str = cactus_complete(
+                model,
+                [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + messages,
+                tools=cactus_tools,
+                force_tools=True,
+                max_tokens=cfg["max_tokens"],
+                tool_rag_top_k=cfg["tool_rag_top_k"],      # native Cactus RAG tool filtering
+                confidence_threshold=_native_threshold(threshold, relax),   # native Cactus confidence gate
+                stop_sequences=["<|im_end|>", "<end_of_turn>"],
+                **options,
+            )
+    except PoolExhausted:
+        # Every handle is busy and the queue is full: go straight to cloud
+        return {}, False
 
-    local_confidence = raw.get("confidence", 0)
-    local_function_calls = raw.get("function_calls", [])
-    local_time_ms = raw.get("total_time_ms", 0)
-    cloud_handoff = raw.get("cloud_handoff", False)
+    raw = _parse_raw(raw_str)
+    if stream is not None:
+        raw = _apply_early_exit(raw, stream)
+    if _VALIDATION_CONFIG["enabled"] and raw.get("function_calls"):
+        raw["function_calls"], raw["validation"] = validate_calls(raw["function_calls"], tools)
+    return raw, True
+
+
+def _run_clause(clause, tools, confidence_threshold):
+    """One clause of a split request: fast path, else a local pass over its own tool subset."""
+    messages = _clause_messages(clause)
+    if _FAST_PATH_ENABLED:
+        hit = _fast_path(messages, tools)
+        if hit is not None:
+            return {"function_calls": [hit[1]], "confidence": 1.0}, False, True
+    subset = _clause_tools(clause, tools, _SPLIT_CONFIG["tools_per_clause"])
+    _, cfg, threshold, _ = _route_plan(messages, subset, confidence_threshold)
+    relax = confidence_threshold is None
+    raw, ran_local = _run_local(messages, subset, cfg, threshold, relax)
+    return raw, ran_local, _accept_local(raw, threshold, relax)
+
+
+def _run_split(clauses, tools, confidence_threshold):
+    """Run the clauses in parallel and merge them into one raw-shaped response.
+
+    Returns (raw, ran_local, accepted); accepted only if every clause was.
+    """
+    start = time.time()
+    futures = [_clause_executor.submit(_run_clause, c, tools, confidence_threshold) for c in clauses]
+    parts = [f.result() for f in futures]
+    accepted = all(ok for _, _, ok in parts)
+    raw = {
+        "function_calls": _dedupe_calls([call for r, _, _ in parts for call in r.get("function_calls", [])]),
+        "confidence": min(r.get("confidence", 0) for r, _, _ in parts),
+        "total_time_ms": (time.time() - start) * 1000,      # wall time: clauses overlap
+        "cloud_handoff": not accepted,
+        "split": len(clauses),
+    }
+    return raw, any(ran for _, ran, _ in parts), accepted
+
+
+def _local_pass(messages, tools, cfg, threshold, clauses, confidence_threshold):
+    """Split pass for compound requests, else the single local pass. Returns (raw, ran_local, accepted)."""
+    if clauses:
+        return _run_split(clauses, tools, confidence_threshold)
+    relax = confidence_threshold is None
+    raw, ran_local = _run_local(messages, tools, cfg, threshold, relax)
+    return raw, ran_local, _accept_local(raw, threshold, relax)
 
+
+def _accept_local(raw, threshold, relax=True):
     # Accept on-device result: not a cloud_handoff, confidence met, and non-empty calls
-    if not cloud_handoff and local_confidence >= threshold and local_function_calls:
-        return {
-            "function_calls": local_function_calls,
-            "total_time_ms": local_time_ms,
-            "confidence": local_confidence,
-            "source": "on-device",
-            "complexity": complexity,
-        }
+    validation = raw.get("validation")
+    if validation == "invalid":
+        return False
+    if validation is not None and relax:     # a caller-supplied threshold is not relaxed
+        threshold -= _VALIDATION_CONFIG["margin"]
+    return (
+        not raw.get("cloud_handoff", False)
+        and raw.get("confidence", 0) >= threshold
+        and bool(raw.get("function_calls", []))
+    )
 
-    # Fall back to cloud
-    cloud = generate_cloud(messages, tools)
+
+# Diagnostics from the local pass that are copied onto the result
+_PASS_THROUGH = ("early_exit", "split", "validation", "repair")
+
+
+def _on_device_result(raw, complexity):
+    return {
+        "function_calls": raw.get("function_calls", []),
+        "total_time_ms": raw.get("total_time_ms", 0),
+        "confidence": raw.get("confidence", 0),
+        "source": "on-device",
+        "complexity": complexity,
+        **{k: raw[k] for k in _PASS_THROUGH if k in raw},
+    }
+
+
+def _direct_cloud_result(cloud, complexity, p_fallback):
+    cloud["source"] = "cloud (direct)"
+    cloud["fallback_probability"] = p_fallback
+    cloud["complexity"] = complexity
+    return cloud
+
+
+def _fallback_result(cloud, raw, complexity, hedged):
+    local_time_ms = raw.get("total_time_ms", 0)
+    if hedged:
+        # Both ran concurrently from the same start, so latency is the slower of the two
+        cloud["total_time_ms"] = max(cloud["total_time_ms"], local_time_ms)
+        cloud["hedged"] = True
+    else:
+        cloud["total_time_ms"] += local_time_ms
     cloud["source"] = "cloud (fallback)"
-    cloud["local_confidence"] = local_confidence
-    cloud["total_time_ms"] += local_time_ms
+    cloud["local_confidence"] = raw.get("confidence", 0)
     cloud["complexity"] = complexity
+    cloud.update({k: raw[k] for k in _PASS_THROUGH if k in raw})
     return cloud
 
 
+def generate_hybrid(messages, tools, confidence_threshold=None, use_cache=True):
+    """Hybrid inference: classify complexity, route to on-device or cloud.
+
+    Results are cached on the canonicalized messages plus a hash of the tool
+    schemas; a hit comes back tagged ``source: "cache"``. Pass
+    ``use_cache=False`` to force a fresh inference.
+    """
+    if not use_cache:
+        return _route_hybrid(messages, tools, confidence_threshold)
+
+    key = (_canonical_messages(messages), _tools_hash(tools), confidence_threshold)
+    hit = _cache_lookup(key)
+    if hit is not None:
+        return hit
+
+    result = _route_hybrid(messages, tools, confidence_threshold)
+    _cache_store(key, result)
+    return result
+
+
+def _route_hybrid(messages, tools, confidence_threshold=None):
+    """Uncached routing behind generate_hybrid.
+
+    Unambiguous single intents are answered by the rule-based fast path
+    without running the model. Otherwise borrows a persistent Cactus handle
+    from the model pool so concurrent callers run in parallel. Complexity-aware
+    routing lowers confidence thresholds for simple requests so more work
+    stays on-device. Requests likely to fall back are hedged: Gemini starts
+    in parallel with the local pass and its result is discarded if the local
+    result is accepted. Compound requests are split into single-intent
+    clauses that run as parallel on-device passes. Single-intent requests the
+    learned router is near-certain about go straight to the cloud.
+    """
+    fast = _fast_path_result(messages, tools, time.time())
+    if fast is not None:
+        return fast
+
+    complexity, cfg, threshold, p_fallback = _route_plan(messages, tools, confidence_threshold)
+    clauses = _split_intents(messages, tools)
+
+    # The router scores a whole-request pass; a split request gets its own try
+    if not clauses and _should_skip_local(p_fallback):
+        return _direct_cloud_result(generate_cloud(messages, tools), complexity, p_fallback)
+
+    cloud_future = None
+    if _should_hedge(p_fallback, split=bool(clauses)):
+        cloud_future = _cloud_executor.submit(generate_cloud, messages, tools)
+
+    raw, ran_local, accepted = _local_pass(messages, tools, cfg, threshold, clauses, confidence_threshold)
+    if ran_local:
+        _fallback_tracker.record(complexity, not accepted)
+
+    if accepted:
+        if cloud_future is not None:
+            cloud_future.cancel()   # no-op once running; the result is simply discarded
+        return _on_device_result(raw, complexity)
+
+    # Fall back to cloud
+    if cloud_future is not None:
+        cloud = cloud_future.result()
+    else:
+        cloud = generate_cloud(messages, tools)
+    return _fallback_result(cloud, raw, complexity, hedged=cloud_future is not None)
+
+
+async def generate_hybrid_async(messages, tools, confidence_threshold=None, use_cache=True):
+    """Async generate_hybrid for event-loop callers (same routing, same result shape).
+
+    The local pass runs in the default executor; cloud calls use the async
+    Gemini client, so an in-flight fallback holds no thread. A hedged cloud
+    request is cancelled outright when the local result is accepted.
+    """
+    key = None
+    if use_cache:
+        key = (_canonical_messages(messages), _tools_hash(tools), confidence_threshold)
+        hit = _cache_lookup(key)
+        if hit is not None:
+            return hit
+
+    fast = _fast_path_result(messages, tools, time.time())
+    if fast is not None:
+        if key is not None:
+            _cache_store(key, fast)
+        return fast
+
+    complexity, cfg, threshold, p_fallback = _route_plan(messages, tools, confidence_threshold)
+    clauses = _split_intents(messages, tools)
+
+    if not clauses and _should_skip_local(p_fallback):
+        result = _direct_cloud_result(await generate_cloud_async(messages, tools), complexity, p_fallback)
+        if key is not None:
+            _cache_store(key, result)
+        return result
+
+    cloud_task = None
+    if _should_hedge(p_fallback, split=bool(clauses)):
+        cloud_task = asyncio.create_task(generate_cloud_async(messages, tools))
+
+    loop = asyncio.get_running_loop()
+    try:
+        raw, ran_local, accepted = await loop.run_in_executor(
+            None, _local_pass, messages, tools, cfg, threshold, clauses, confidence_threshold,
+        )
+    except BaseException:
+        if cloud_task is not None:
+            cloud_task.cancel()
+        raise
+    if ran_local:
+        _fallback_tracker.record(complexity, not accepted)
+
+    if accepted:
+        if cloud_task is not None:
+            cloud_task.cancel()
+        result = _on_device_result(raw, complexity)
+    else:
+        cloud = await (cloud_task if cloud_task is not None else generate_cloud_async(messages, tools))
+        result = _fallback_result(cloud, raw, complexity, hedged=cloud_task is not None)
+
+    if key is not None:
+        _cache_store(key, result)
+    return result
+
+
 def print_result(label, result):
     """Pretty-print a generation result."""
     print(f"\n=== {label} ===\n")
@@ -0,0 +1,126 @@
+"""
+Structured pre-scoring for /ai/rank-contacts.
+
+Most of a contact's fit for a query follows from its structured fields, so
+candidates are scored against the query in one NumPy pass before any model
+runs. Each field (skills, can_help_with, domains, plus role/bio as a weak
+free-text field) becomes a boolean term matrix over the query's vocabulary: every list entry contributes its word tokens and the whole phrase
+("AI/ML" -> "ai", "ml", "ai/ml"). A field score is the IDF-weighted share of
+the query's terms the contact covers; the field scores are blended with fixed
+weights, and an optional retrieval score (from the profile index) is mixed in.
+
+ai_server.py sends only the best few to generate_hybrid for a model score,
+reason and outreach angle; the rest keep their pre-score and a reason built
+from the matched field entries.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9+#]+")
+_STOPWORDS = frozenset("a an and as at for in of on or the to with who someone something need needs".split())
+
+# What the query asks for, and which contact fields answer it
+QUERY_FIELDS = {
+    "need":   ("skills", "can_help_with", "text"),       # query_looking_for + query_help_type
+    "domain": ("domains", "skills", "text"),              # query_domain
+}
+FIELD_WEIGHTS = {
+    ("need", "skills"): 0.30,
+    ("need", "can_help_with"): 0.25,
+    ("need", "text"): 0.05,
+    ("domain", "domains"): 0.30,
+    ("domain", "skills"): 0.05,
+    ("domain", "text"): 0.05,
+}
+RETRIEVAL_WEIGHT = 0.2
+
+
+@lru_cache(maxsize=8192)
+def _phrase_terms(value):
+    tokens = [t for t in _TOKEN_RE.findall(value.lower()) if t not in _STOPWORDS]
+    return frozenset(tokens + [" ".join(tokens)] if len(tokens) > 1 else tokens)
+
+
+def terms(values):
+    """Normalised terms of a phrase or list of phrases: word tokens plus each whole phrase."""
+    if isinstance(values, str):
+        return set(_phrase_terms(values))
+    return set().union(*map(_phrase_terms, values))
+
+
+def _field_entries(contact):
+    return {
+        "skills": contact.skills,
+        "can_help_with": contact.can_help_with,
+        "domains": contact.domains,
+        "text": [contact.role, contact.bio],
+    }
+
+
+def prescore(query, candidates, retrieval=None):
+    """Score ``candidates`` (ContactProfile-like) against ``query``.
+
+    ``query`` maps "need" and "domain" to text; ``retrieval`` maps contact id
+    -> similarity in [0, 1]. Returns (scores, matched): an (n,) float32 array
+    in [0, 1], and per contact the field entries that matched the query.
+    """
+    n = len(candidates)
+    query_terms = {key: terms(query.get(key, "")) for key in QUERY_FIELDS}
+    fields = [_field_entries(c) for c in candidates]
+    vocab = {t: i for i, t in enumerate(sorted(set().union(*query_terms.values())))}
+    scores = np.zeros(n, dtype=np.float32)
+    matched = [dict() for _ in range(n)]
+    if not n or not vocab:
+        return scores, matched
+
+    # Boolean (n, V) matrices over the query vocabulary; terms outside it cannot score
+    names = ("skills", "can_help_with", "domains", "text")
+    mats = {}
+    for name in names:
+        rows, cols = [], []
+        for i, f in enumerate(fields):
+            for t in terms(f[name]):
+                if t in vocab:
+                    rows.append(i)
+                    cols.append(vocab[t])
+        mats[name] = np.zeros((n, len(vocab)), dtype=bool)
+        mats[name][rows, cols] = True
+
+    # IDF over the candidate pool: a term every contact has does not separate them
+    df = np.logical_or.reduce([mats[name] for name in names]).sum(axis=0)
+    idf = np.log(1 + (n + 1) / (df + 1)).astype(np.float32)
+
+    for key in ("need", "domain"):
+        q = np.zeros(len(vocab), dtype=np.float32)
+        q[[vocab[t] for t in query_terms[key]]] = 1.0
+        qw = q * idf
+        total = float(qw.sum())
+        if not total:
+            continue
+        for name in QUERY_FIELDS[key]:
+            hit = mats[name] @ qw / total
+            scores += FIELD_WEIGHTS[(key, name)] * hit
+            for i in np.flatnonzero(hit):
+                entries = [e for e in fields[i][name] if _phrase_terms(e) & query_terms[key]]
+                matched[i].setdefault(name, []).extend(entries)
+    if retrieval:
+        sim = np.array([retrieval.get(c.id, 0.0) for c in candidates], dtype=np.float32)
+        scores = (1 - RETRIEVAL_WEIGHT) * scores + RETRIEVAL_WEIGHT * sim
+    for m in matched:
+        for name in m:
+            m[name] = list(dict.fromkeys(m[name]))
+    return np.clip(scores, 0.0, 1.0), matched
+
+
+def reason(contact, matched):
+    """One-sentence match reason from the pre-score's matched entries."""
+    parts = []
+    for name, label in (("can_help_with", "can help with"), ("skills", "skills in"), ("domains", "works in")):
+        if matched.get(name):
+            parts.append(f"{label} {', '.join(matched[name][:3])}")
+    if not parts:
+        return ""
+    return f"{contact.name} {'; '.join(parts)}."
@@ -0,0 +1,506 @@
+"""
+Incremental hybrid BM25 + vector index over profile texts for /ai/rank-contacts.
+
+Each profile is tokenized into an inverted index (BM25 over its field values)
+and, optionally, embedded into a dense vector column; a query blends the two
+scores. Everything is plain NumPy, so retrieval works with or without the
+native Cactus library.
+
+The index is published as an immutable snapshot: writers build the next
+snapshot off to the side and swap the reference, so queries never wait on a
+write. Every swap bumps ``generation``. ``save`` writes a snapshot as .npy
+files in a versioned directory under ``persist_dir`` (rag_corpus/index/ in
+ai_server.py); ``open`` maps them back with mmap, so startup does not re-embed
+or re-tokenize the corpus.
+
+BackgroundIndexer sits in front of the index for the sync endpoint: events are
+coalesced per profile over a debounce window and applied as one batch, so a
+bulk import of N profiles costs a handful of swaps rather than N.
+
+The embedder is pluggable: ai_server.py passes cactus_embed on pooled handles
+when the native library has it, otherwise hashed_embedding (signed feature
+hashing over words and word bigrams) is used. Queries and writes may use
+separate embedders so a reindex never holds a handle a query is waiting on.
+"""
+
+import itertools
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+
+HASH_DIM = 512
+BM25_K1 = 1.2
+BM25_B = 0.75
+_MAX_TERM = 32          # terms are stored as fixed-width <U32 for searchsorted lookup
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+# Field labels of the corpus .txt format and the LinkedIn line carry no signal
+_FIELD_LABEL_RE = re.compile(r"^(?:[A-Za-z ]+):\s*", re.MULTILINE)
+_LINKEDIN_RE = re.compile(r"^LinkedIn:.*$", re.MULTILINE)
+_CURRENT = "CURRENT"
+
+
+def hashed_embedding(text, dim=HASH_DIM):
+    """L2-normalised signed hashing of unigrams and bigrams (stable across processes)."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vec = np.zeros(dim, dtype=np.float32)
+    for gram in grams:
+        h = zlib.crc32(gram.encode())
+        vec[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def profile_terms(text):
+    """BM25 terms of a profile (or query): field values only, lower-cased, capped in length."""
+    text = _FIELD_LABEL_RE.sub(" ", _LINKEDIN_RE.sub("", text))
+    return [t[:_MAX_TERM] for t in _TOKEN_RE.findall(text.lower())]
+
+
+class _Snapshot:
+    """One published, never-mutated state of the index.
+
+    Postings are CSR by term: documents and term frequencies of term ``t`` are
+    ``post_doc[offsets[t]:offsets[t + 1]]`` / ``post_tf[...]``. Terms are looked
+    up by binary search in ``vocab_sorted``; ``vocab_ids`` maps back to term ids.
+    Arrays may be read-only memory maps.
+    """
+
+    __slots__ = ("ids", "vectors", "doc_len", "vocab_sorted", "vocab_ids", "offsets",
+                 "post_doc", "post_tf", "generation", "built_at", "_norm")
+
+    def __init__(self, ids, vectors, doc_len, vocab_sorted, vocab_ids, offsets, post_doc, post_tf,
+                 generation, built_at):
+        self.ids = ids                      # (n,) str: row -> profile id
+        self.vectors = vectors              # (n, dim) float32, or None without an embedder
+        self.doc_len = doc_len              # (n,) float32 term counts
+        self.vocab_sorted = vocab_sorted    # (V,) <U32
+        self.vocab_ids = vocab_ids          # (V,) int32
+        self.offsets = offsets              # (V + 1,) int64
+        self.post_doc = post_doc            # (P,) int32
+        self.post_tf = post_tf              # (P,) float32
+        self.generation = generation
+        self.built_at = built_at
+        avg = float(doc_len.mean()) if len(doc_len) else 1.0
+        self._norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_len / (avg or 1.0))).astype(np.float32)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.array([], dtype=str), None, np.zeros(0, np.float32), np.array([], dtype=f"<U{_MAX_TERM}"),
+                   np.zeros(0, np.int32), np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.float32),
+                   0, None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, terms):
+        """Term ids for ``terms`` (array of str); -1 where unknown."""
+        terms = np.asarray(terms, dtype=f"<U{_MAX_TERM}")
+        if not len(self.vocab_sorted) or not len(terms):
+            return np.full(len(terms), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.vocab_sorted, terms), len(self.vocab_sorted) - 1)
+        return np.where(self.vocab_sorted[pos] == terms, self.vocab_ids[pos], -1)
+
+    def bm25(self, terms):
+        """(n,) BM25 scores of every document for the query terms."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        n = len(self)
+        for t in set(int(t) for t in self.lookup(sorted(set(terms))) if t >= 0):
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            if lo == hi:
+                continue
+            docs, tf = self.post_doc[lo:hi], self.post_tf[lo:hi]
+            idf = np.log(1 + (n - (hi - lo) + 0.5) / ((hi - lo) + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def rebuilt(self, removed, added_ids, added_terms, added_vectors, generation):
+        """Next snapshot: drop rows whose id is in ``removed``, append the added docs."""
+        keep = ~np.isin(self.ids, list(removed)) if len(self) and removed else np.ones(len(self), dtype=bool)
+        remap = np.cumsum(keep) - 1
+
+        # Surviving postings, renumbered
+        post_term = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int64), np.diff(self.offsets))
+        live = keep[self.post_doc] if len(self.post_doc) else np.zeros(0, dtype=bool)
+        terms_old, docs_old, tf_old = post_term[live], remap[self.post_doc[live]], self.post_tf[live]
+
+        # New terms get the next ids; the sorted vocabulary is rebuilt around them
+        new_vocab = sorted({t for terms in added_terms for t in terms})
+        known = self.lookup(new_vocab)
+        unseen = [t for t, i in zip(new_vocab, known) if i < 0]
+        n_terms = len(self.vocab_sorted)
+        term_id = {t: int(i) for t, i in zip(new_vocab, known) if i >= 0}
+        term_id.update({t: n_terms + j for j, t in enumerate(unseen)})
+        vocab = np.concatenate([self.vocab_sorted, np.asarray(unseen, dtype=f"<U{_MAX_TERM}")])
+        vocab_ids = np.concatenate([self.vocab_ids, np.arange(n_terms, n_terms + len(unseen), dtype=np.int32)])
+        order = np.argsort(vocab, kind="stable")
+
+        base = int(keep.sum())
+        new_t, new_d, new_f = [], [], []
+        for j, terms in enumerate(added_terms):
+            for term, tf in Counter(terms).items():
+                new_t.append(term_id[term])
+                new_d.append(base + j)
+                new_f.append(tf)
+        post_term = np.concatenate([terms_old, np.asarray(new_t, dtype=np.int64)])
+        post_doc = np.concatenate([docs_old, np.asarray(new_d, dtype=np.int64)]).astype(np.int32)
+        post_tf = np.concatenate([tf_old, np.asarray(new_f, dtype=np.float32)])
+        # Old postings are already in (term, doc) order and new docs get the highest
+        # ids, so a stable sort by term alone (timsort on near-sorted runs) suffices
+        by_term = np.argsort(post_term, kind="stable")
+        n_vocab = len(vocab)
+        offsets = np.zeros(n_vocab + 1, dtype=np.int64)
+        np.cumsum(np.bincount(post_term, minlength=n_vocab), out=offsets[1:])
+
+        vectors = None
+        if added_vectors is not None:
+            parts = ([np.asarray(self.vectors)[keep]] if self.vectors is not None else []) + [added_vectors]
+            dims = {p.shape[1] for p in parts if len(p)}
+            if len(dims) > 1:
+                raise ValueError(f"embedding dims differ: {sorted(dims)}")
+            vectors = np.ascontiguousarray(np.concatenate(parts))
+        elif self.vectors is not None and not len(added_ids):
+            vectors = np.ascontiguousarray(np.asarray(self.vectors)[keep])
+        return _Snapshot(
+            np.concatenate([self.ids[keep], np.asarray(added_ids, dtype=str)]),
+            vectors,
+            np.concatenate([self.doc_len[keep], np.asarray([len(t) for t in added_terms], dtype=np.float32)]),
+            vocab[order], vocab_ids[order], offsets,
+            post_doc[by_term], post_tf[by_term],
+            generation, time.time(),
+        )
+
+    _FILES = ("ids", "doc_len", "vocab_sorted", "vocab_ids", "offsets", "post_doc", "post_tf")
+
+    def save(self, path, meta):
+        os.makedirs(path, exist_ok=True)
+        for name in self._FILES:
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(getattr(self, name)))
+        if self.vectors is not None:
+            np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(dict(meta, generation=self.generation, built_at=self.built_at), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in cls._FILES}
+        vectors_path = os.path.join(path, "vectors.npy")
+        vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        return cls(vectors=vectors, generation=meta["generation"], built_at=meta["built_at"], **arrays), meta
+
+
+class ProfileIndex:
+    """Profile id -> BM25 postings and embedding rows, published as immutable snapshots.
+
+    ``apply`` tokenizes and embeds outside any lock, then builds the next
+    snapshot from the current one and swaps it in; the write lock only orders
+    concurrent writers. ``query`` reads whichever snapshot is current and
+    takes no lock. ``embed=None`` disables the vector column; ``query_embed``
+    defaults to ``embed``. ``vector_weight`` is the dense share of the blended
+    score (BM25 is scaled to [0, 1] by its best hit first).
+    """
+
+    def __init__(self, embed=hashed_embedding, query_embed=None, vector_weight=0.5,
+                 persist_dir=None, embedder_name="hashed"):
+        self._embed = embed
+        self._query_embed = query_embed or embed
+        self.vector_weight = vector_weight if embed is not None else 0.0
+        self.persist_dir = persist_dir
+        self.embedder_name = embedder_name if embed is not None else None
+        self._write_lock = threading.Lock()
+        self._snapshot = _Snapshot.empty()
+        self.saved_generation = None
+        self.loaded = False             # set once load_dir has scanned the corpus
+        # metrics; readers only bump an itertools counter (atomic under the GIL)
+        self._queries = itertools.count(1)
+        self._query_total = 0
+        self._writes = 0
+        self._write_wait_ms = 0.0
+        self._write_wait_max_ms = 0.0
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    @property
+    def generation(self):
+        return self._snapshot.generation
+
+    @property
+    def built_at(self):
+        return self._snapshot.built_at
+
+    @staticmethod
+    def _normalised(embed, text):
+        vec = np.asarray(embed(text), dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+    def apply(self, upserts=None, removals=()):
+        """Upsert {profile_id: text} and drop ``removals`` in one swap. Returns the new generation."""
+        upserts = upserts or {}
+        added_ids = list(upserts)
+        added_terms = [profile_terms(upserts[pid]) for pid in added_ids]
+        added_vectors = None
+        if self._embed is not None and added_ids:
+            added_vectors = np.stack([self._normalised(self._embed, upserts[pid]) for pid in added_ids])
+        start = time.time()
+        with self._write_lock:
+            wait_ms = (time.time() - start) * 1000
+            self._writes += 1
+            self._write_wait_ms += wait_ms
+            self._write_wait_max_ms = max(self._write_wait_max_ms, wait_ms)
+            snap = self._snapshot
+            removed = set(removals) | set(added_ids)
+            if not added_ids and not np.isin(snap.ids, list(removed)).any():
+                return snap.generation
+            self._snapshot = snap.rebuilt(removed, added_ids, added_terms, added_vectors, snap.generation + 1)
+            return self._snapshot.generation
+
+    def upsert(self, profile_id, text):
+        return self.apply({profile_id: text})
+
+    def remove(self, profile_id):
+        return self.apply(removals=[profile_id])
+
+    def load_dir(self, corpus_dir, since=None):
+        """Index every <profile_id>.txt under ``corpus_dir``.
+
+        With ``since`` (a built_at timestamp, after ``open``), only files modified
+        after it are re-read, and profiles whose file is gone are dropped.
+        Returns the number of profiles indexed.
+        """
+        if not os.path.isdir(corpus_dir):
+            self.loaded = True
+            return 0
+        texts, on_disk = {}, set()
+        with os.scandir(corpus_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".txt"):
+                    continue
+                profile_id = os.path.splitext(entry.name)[0]
+                on_disk.add(profile_id)
+                if since is None or entry.stat().st_mtime > since:
+                    with open(entry.path) as f:
+                        texts[profile_id] = f.read()
+        removals = set(self._snapshot.ids.tolist()) - on_disk if since is not None else ()
+        if texts or removals:
+            self.apply(texts, removals)
+        self.loaded = True
+        return len(texts)
+
+    def query(self, text, top_k=8):
+        """Best-matching (profile_id, score) pairs, highest first."""
+        self._query_total = next(self._queries)
+        snap = self._snapshot
+        n = len(snap)
+        if n == 0 or top_k <= 0:
+            return []
+        scores = snap.bm25(profile_terms(text))
+        best = float(scores.max())
+        if best > 0:
+            scores /= best
+        if snap.vectors is not None and self.vector_weight > 0:
+            dense = np.maximum(snap.vectors @ self._normalised(self._query_embed, text), 0)
+            scores = (1 - self.vector_weight) * scores + self.vector_weight * dense
+        k = min(top_k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(str(snap.ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    # --- Persistence ---
+
+    def save(self):
+        """Write the current snapshot under persist_dir and point CURRENT at it."""
+        if not self.persist_dir:
+            return None
+        snap = self._snapshot
+        if snap.generation == self.saved_generation:
+            return snap.generation
+        name = f"gen-{snap.generation}-{os.getpid()}"
+        snap.save(os.path.join(self.persist_dir, name), {"embedder": self.embedder_name})
+        tmp = os.path.join(self.persist_dir, f"{_CURRENT}.tmp")
+        with open(tmp, "w") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(self.persist_dir, _CURRENT))
+        # Open memory maps of older generations stay valid after unlinking
+        for old in os.listdir(self.persist_dir):
+            if old.startswith("gen-") and old != name:
+                shutil.rmtree(os.path.join(self.persist_dir, old), ignore_errors=True)
+        self.saved_generation = snap.generation
+        return snap.generation
+
+    def open(self):
+        """Map the last saved snapshot. Returns False if there is none or it was built
+        with a different embedder (its vectors would not be comparable)."""
+        if not self.persist_dir:
+            return False
+        try:
+            with open(os.path.join(self.persist_dir, _CURRENT)) as f:
+                snap, meta = _Snapshot.load(os.path.join(self.persist_dir, f.read().strip()))
+        except (OSError, ValueError, KeyError):
+            return False
+        if meta.get("embedder") != self.embedder_name:
+            return False
+        with self._write_lock:
+            self._snapshot = snap
+            self.saved_generation = snap.generation
+        return True
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "loaded": self.loaded,
+            "profiles": len(snap),
+            "terms": len(snap.vocab_sorted),
+            "postings": len(snap.post_doc),
+            "dim": None if snap.vectors is None else int(snap.vectors.shape[1]),
+            "generation": snap.generation,
+            "saved_generation": self.saved_generation,
+            "built_at": snap.built_at,
+            "queries": self._query_total,
+            "writes": self._writes,
+            "write_lock_wait_avg_ms": self._write_wait_ms / self._writes if self._writes else 0.0,
+            "write_lock_wait_max_ms": self._write_wait_max_ms,
+        }
+
+
+class BackgroundIndexer:
+    """Debounced writer thread in front of a ProfileIndex.
+
+    ``submit`` records the latest text per profile and returns at once. The
+    thread applies pending events as one batch once ``debounce_s`` passes with
+    no new event, or ``max_delay_s`` after the oldest pending event, whichever
+    comes first, so a steady stream of syncs still lands regularly. When the
+    index has a persist_dir, a batch also saves it, at most every
+    ``persist_interval_s``; ``stop`` saves whatever is left.
+    """
+
+    def __init__(self, index, debounce_s=0.5, max_delay_s=5.0, persist_interval_s=30.0):
+        self.index = index
+        self.debounce_s = debounce_s
+        self.max_delay_s = max_delay_s
+        self.persist_interval_s = persist_interval_s
+        self._last_saved_at = time.time()
+        self._cond = threading.Condition()
+        self._pending = {}              # profile id -> text, or None for a removal
+        self._first_pending_at = None
+        self._last_event_at = None
+        self._applying = False
+        self._stopped = False
+        self._thread = None
+        # metrics
+        self.events = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profile-indexer", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def alive(self):
+        """Whether the writer thread is running; syncs only queue up when it is not."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, profile_id, text):
+        self._enqueue(profile_id, text)
+
+    def remove(self, profile_id):
+        self._enqueue(profile_id, None)
+
+    def _enqueue(self, profile_id, text):
+        with self._cond:
+            now = time.time()
+            self._pending[profile_id] = text
+            self._first_pending_at = self._first_pending_at or now
+            self._last_event_at = now
+            self.events += 1
+            self._cond.notify_all()
+
+    def _due_in(self, now):
+        return min(self._last_event_at + self.debounce_s, self._first_pending_at + self.max_delay_s) - now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._pending or self._due_in(time.time()) > 0):
+                    self._cond.wait(None if not self._pending else self._due_in(time.time()))
+                if self._stopped and not self._pending:
+                    return
+                batch, self._pending = self._pending, {}
+                self._first_pending_at = self._last_event_at = None
+                self._applying = True
+            try:
+                self.index.apply(
+                    {pid: text for pid, text in batch.items() if text is not None},
+                    [pid for pid, text in batch.items() if text is None],
+                )
+                self.batches += 1
+                if self.index.persist_dir and time.time() - self._last_saved_at >= self.persist_interval_s:
+                    self.save()
+            except Exception as e:      # a bad batch must not kill the writer
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            finally:
+                with self._cond:
+                    self._applying = False
+                    self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Apply anything pending now and wait for it to land. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if self._pending:
+                self._first_pending_at = self._last_event_at = time.time() - max(self.debounce_s, self.max_delay_s)
+                self._cond.notify_all()
+            while self._pending or self._applying:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def save(self):
+        self._last_saved_at = time.time()
+        return self.index.save()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.save()
+        except OSError as e:
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+            oldest = self._first_pending_at
+        now = time.time()
+        return {
+            **self.index.stats(),
+            "indexer_alive": self.alive,
+            "pending": pending,
+            # How far behind the published snapshot is: age of the oldest unapplied sync
+            "staleness_s": round(now - oldest, 3) if oldest is not None else 0.0,
+            "events": self.events,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,137 @@
+"""
+Versioned per-profile cache of rank_contact results for /ai/rank-contacts.
+
+The same networking queries are re-ranked against the same unchanged profiles
+all day. Entries are keyed by (normalized query, profile id, content version),
+where the version is a hash of the profile text the model saw, so an edited
+profile can never be served a ranking of its old content. ``invalidate`` drops
+every entry of a profile when /ai/sync-profile-rag updates it, which frees the
+memory straight away instead of waiting for LRU eviction.
+
+The cache is an LRU bounded by the approximate size of its entries. ``save``
+and ``load`` persist it as one JSON file (written to a temp file and swapped
+in), so rankings survive a restart.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(*parts):
+    """Case- and whitespace-insensitive query key."""
+    return "|".join(" ".join(str(p).lower().split()) for p in parts)
+
+
+def content_version(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class RankCache:
+    """Thread-safe LRU of rankings keyed by (query, profile_id, version), bounded by bytes."""
+
+    def __init__(self, max_bytes, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()   # (query, profile_id, version) -> (size, ranking)
+        self._by_profile = {}           # profile_id -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, query, profile_id, version):
+        key = (query, profile_id, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, query, profile_id, version, ranking):
+        key = (query, profile_id, version)
+        size = len(json.dumps(ranking)) + len(query) + len(profile_id) + len(version)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (size, dict(ranking))
+            self._by_profile.setdefault(profile_id, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[0]
+        keys = self._by_profile.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_profile[key[1]]
+
+    def invalidate(self, profile_id):
+        """Drop every cached ranking of ``profile_id``. Returns how many were dropped."""
+        with self._lock:
+            keys = list(self._by_profile.get(profile_id, ()))
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_profile.clear()
+            self._bytes = 0
+
+    def save(self):
+        """Write the entries to ``path`` (least recently used first). Returns the count."""
+        if not self.path:
+            return 0
+        with self._lock:
+            rows = [[*key, ranking] for key, (_, ranking) in self._entries.items()]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "entries": rows}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        return len(rows)
+
+    def load(self):
+        """Restore entries saved by ``save``; a missing or unreadable file is ignored."""
+        if not self.path:
+            return 0
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)["entries"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+        for query, profile_id, version, ranking in rows:
+            self.put(query, profile_id, version, ranking)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "profiles": len(self._by_profile),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
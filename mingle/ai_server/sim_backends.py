@@ -0,0 +1,366 @@
+"""
+Simulated inference backends - run the router without Cactus or a Gemini key.
+
+Two stand-ins:
+  - a deterministic simulated local model with the cactus_init / cactus_complete /
+    cactus_destroy / cactus_rag_query interface, selected in main.py with
+    MINGLE_LOCAL_BACKEND=sim
+  - a fake Gemini HTTP server speaking the generateContent REST API, so the real
+    genai client (pooling, retries, timings) is exercised end to end
+
+Answers come from an oracle built from benchmark.BENCHMARKS, or from a recordings
+file (MINGLE_SIM_RECORDINGS) when one is given. Latency, confidence and accuracy
+per difficulty are configurable via a JSON file (MINGLE_SIM_CONFIG) merged over
+DEFAULT_CONFIG.
+
+Usage (serve defaults MINGLE_LOCAL_BACKEND to sim: the oracle imports
+benchmark, which imports main):
+    python sim_backends.py serve --port 8765 &
+    MINGLE_LOCAL_BACKEND=sim GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=sim \
+        python benchmark.py --repeats 5
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONFIG = {
+    "seed": 0,
+    # Multiplier on simulated latency actually slept (0 = report only, no sleeping)
+    "time_scale": 1.0,
+    "local": {
+        "latency_ms": {"easy": [120, 20], "medium": [180, 30], "hard": [300, 50]},   # [mean, std]
+        "accuracy": {"easy": 0.9, "medium": 0.7, "hard": 0.3},
+        "confidence_correct": [0.93, 0.04],
+        "confidence_wrong": [0.7, 0.15],
+    },
+    "cloud": {
+        "latency_ms": [650, 150],
+        "accuracy": 0.97,
+    },
+}
+
+
+def _merge(base, override):
+    merged = dict(base)
+    for k, v in override.items():
+        merged[k] = _merge(base[k], v) if isinstance(v, dict) and isinstance(base.get(k), dict) else v
+    return merged
+
+
+def load_config(path=None):
+    path = path or os.environ.get("MINGLE_SIM_CONFIG")
+    if not path:
+        return DEFAULT_CONFIG
+    with open(path) as f:
+        return _merge(DEFAULT_CONFIG, json.load(f))
+
+
+def _user_text(messages):
+    return " ".join(" ".join(str(m["content"]).split()) for m in messages if m["role"] == "user")
+
+
+############## Oracle ##############
+
+class Oracle:
+    """Expected calls (and difficulty) by normalized user text.
+
+    Recordings are JSON lines of {"content", "local", "cloud"} where ``local`` is
+    a raw cactus_complete response and ``cloud`` a list of function calls; a
+    recorded entry is replayed verbatim instead of being simulated.
+    """
+
+    def __init__(self, recordings_path=None):
+        self._cases = None
+        self._recordings = {}
+        self._lock = threading.Lock()
+        path = recordings_path or os.environ.get("MINGLE_SIM_RECORDINGS")
+        if path:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        self._recordings[" ".join(rec["content"].split())] = rec
+
+    def _load_cases(self):
+        # Imported lazily: benchmark imports main, which may be importing us
+        with self._lock:
+            if self._cases is None:
+                from benchmark import BENCHMARKS
+                self._cases = {_user_text(c["messages"]): c for c in BENCHMARKS}
+        return self._cases
+
+    def case(self, text):
+        return self._load_cases().get(text)
+
+    def recording(self, text):
+        return self._recordings.get(text)
+
+
+def _placeholder(spec):
+    kind = str(spec.get("type", "string")).lower()     # Gemini declarations use "NUMBER", "INTEGER"...
+    return {"integer": 0, "number": 0.5, "boolean": False, "array": [], "object": {}}.get(kind, "sim")
+
+
+def _synthesize_calls(tools):
+    """Schema-valid placeholder call for prompts the oracle doesn't know (e.g. server endpoints).
+
+    The local model answers these with the wrong-answer confidence: a
+    placeholder is not a correct answer, and the router must not be credited
+    for accepting one.
+    """
+    if not tools:
+        return []
+    t = tools[0].get("function", tools[0])
+    props = t.get("parameters", {}).get("properties", {})
+    return [{"name": t["name"], "arguments": {k: _placeholder(v) for k, v in props.items()}}]
+
+
+def _corrupt(calls, rng):
+    """Turn a correct answer into a plausible wrong one."""
+    calls = json.loads(json.dumps(calls))
+    if len(calls) > 1 and rng.random() < 0.5:
+        calls.pop(rng.randrange(len(calls)))
+        return calls
+    if not calls:
+        return calls
+    call = rng.choice(calls)
+    if call["arguments"]:
+        key = rng.choice(sorted(call["arguments"]))
+        val = call["arguments"][key]
+        call["arguments"][key] = val + 1 if isinstance(val, (int, float)) else f"{val} please"
+    return calls
+
+
+class _Dice:
+    """Deterministic RNG per (backend, prompt, n-th call for that prompt)."""
+
+    def __init__(self, seed):
+        self._seed = seed
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def roll(self, kind, text):
+        with self._lock:
+            n = self._counts.get((kind, text), 0)
+            self._counts[(kind, text)] = n + 1
+        digest = hashlib.sha256(f"{self._seed}|{kind}|{n}|{text}".encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _gauss_ms(rng, mean_std, floor=1.0):
+    mean, std = mean_std
+    return max(floor, rng.gauss(mean, std))
+
+
+def _sleep(ms, config):
+    if config["time_scale"] > 0:
+        time.sleep(ms * config["time_scale"] / 1000)
+
+
+############## Simulated local model ##############
+
+_config = load_config()
+_oracle = Oracle()
+_dice = _Dice(_config["seed"])
+
+
+class SimModel:
+    def __init__(self, model_path, corpus_dir=None):
+        self.model_path = model_path
+        self.stopped = False
+        self.corpus = {}
+        if corpus_dir and os.path.isdir(corpus_dir):
+            for name in sorted(os.listdir(corpus_dir)):
+                if name.endswith((".txt", ".md")):
+                    with open(os.path.join(corpus_dir, name)) as f:
+                        self.corpus[os.path.join(corpus_dir, name)] = f.read()
+
+
+def cactus_init(model_path, corpus_dir=None):
+    return SimModel(model_path, corpus_dir)
+
+
+def cactus_destroy(model):
+    pass
+
+
+def cactus_stop(model):
+    model.stopped = True
+
+
+def _stream(model, calls, callback):
+    """Emit the calls as JSON one character per token until cactus_stop.
+
+    Returns (calls completed before the stop, fraction of the decode done).
+    """
+    text, ends = "[", []
+    for i, call in enumerate(calls):
+        text += (", " if i else "") + json.dumps(call)
+        ends.append(len(text))
+    text += "]"
+    model.stopped = False
+    for i, ch in enumerate(text):
+        callback(ch, i, None)
+        if model.stopped:
+            return [c for c, end in zip(calls, ends) if end <= i + 1], (i + 1) / len(text)
+    return calls, 1.0
+
+
+def cactus_complete(model, messages, tools=None, confidence_threshold=0.7, callback=None, **options):
+    """Return a cactus_complete-shaped JSON string drawn from the configured distributions."""
+    text = _user_text(messages)
+    recorded = _oracle.recording(text)
+    if recorded and recorded.get("local") is not None:
+        raw = dict(recorded["local"])
+        _sleep(raw.get("total_time_ms", 0), _config)
+        return json.dumps(raw)
+
+    rng = _dice.roll("local", text)
+    local = _config["local"]
+    case = _oracle.case(text)
+    difficulty = case["difficulty"] if case else "easy"
+    expected = case["expected_calls"] if case else _synthesize_calls(tools or [])
+
+    if case is None:
+        correct, calls = False, expected
+    else:
+        correct = rng.random() < local["accuracy"][difficulty]
+        calls = expected if correct else _corrupt(expected, rng)
+    conf_dist = local["confidence_correct"] if correct else local["confidence_wrong"]
+    confidence = min(1.0, max(0.0, rng.gauss(*conf_dist)))
+    total_ms = _gauss_ms(rng, local["latency_ms"][difficulty])
+    handoff = confidence < (confidence_threshold or 0)
+
+    ttft_ms = total_ms * 0.3
+    if callback is not None and not handoff:
+        calls, done = _stream(model, calls, callback)
+        total_ms = ttft_ms + (total_ms - ttft_ms) * done
+    _sleep(total_ms, _config)
+    return json.dumps({
+        "success": not handoff,
+        "error": None,
+        "cloud_handoff": handoff,
+        "response": None,
+        "function_calls": [] if handoff else calls,
+        "confidence": confidence,
+        "time_to_first_token_ms": ttft_ms,
+        "total_time_ms": total_ms,
+        "prefill_tokens": 0,
+        "decode_tokens": 0,
+        "total_tokens": 0,
+    })
+
+
+def cactus_rag_query(model, query, top_k=5):
+    """Rank corpus files by word overlap with the query."""
+    words = set(re.findall(r"\w+", query.lower()))
+    scored = []
+    for path, text in model.corpus.items():
+        overlap = len(words & set(re.findall(r"\w+", text.lower())))
+        if overlap:
+            scored.append({"source": path, "text": text, "score": overlap / max(len(words), 1)})
+    scored.sort(key=lambda c: c["score"], reverse=True)
+    return scored[:top_k]
+
+
+############## Fake Gemini server ##############
+
+def _cloud_calls(text, tools):
+    recorded = _oracle.recording(text)
+    if recorded and recorded.get("cloud") is not None:
+        return recorded["cloud"]
+    rng = _dice.roll("cloud", text)
+    case = _oracle.case(text)
+    expected = case["expected_calls"] if case else _synthesize_calls(tools)
+    return expected if rng.random() < _config["cloud"]["accuracy"] else _corrupt(expected, rng)
+
+
+class _GeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real endpoint
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not re.search(r"/models/[^/:]+:generateContent$", self.path.split("?")[0]):
+            self._send(404, {"error": {"code": 404, "message": f"unknown path {self.path}", "status": "NOT_FOUND"}})
+            return
+        text = " ".join(
+            " ".join(part["text"].split())
+            for content in body.get("contents", [])
+            for part in content.get("parts", []) if "text" in part
+        )
+        tools = [
+            decl for tool in body.get("tools", [])
+            for decl in tool.get("functionDeclarations", tool.get("function_declarations", []))
+        ]
+        calls = _cloud_calls(text, tools)
+        _sleep(_gauss_ms(_dice.roll("cloud-latency", text), _config["cloud"]["latency_ms"]), _config)
+        self._send(200, {
+            "candidates": [{
+                "content": {
+                    "role": "model",
+                    "parts": [{"functionCall": {"name": c["name"], "args": c["arguments"]}} for c in calls],
+                },
+                "finishReason": "STOP",
+            }],
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGeminiServer:
+    """Threaded local generateContent endpoint; use ``base_url`` as GEMINI_BASE_URL."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self._httpd = ThreadingHTTPServer((host, port), _GeminiHandler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated inference backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Run the fake Gemini server in the foreground")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    # The oracle lazily imports benchmark -> main, which needs a local backend
+    os.environ.setdefault("MINGLE_LOCAL_BACKEND", "sim")
+    server = FakeGeminiServer(args.host, args.port)
+    print(f"Fake Gemini listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
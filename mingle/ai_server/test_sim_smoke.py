@@ -0,0 +1,68 @@
+"""Smoke test of the ai_server endpoints against the simulated backends."""
+
+import os
+
+os.environ.setdefault("MINGLE_LOCAL_BACKEND", "sim")
+os.environ.setdefault("GEMINI_API_KEY", "sim")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import ai_server  # noqa: E402
+import main  # noqa: E402
+import sim_backends  # noqa: E402
+from profile_index import BackgroundIndexer, ProfileIndex  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client():
+    config = sim_backends._config
+    # No sleeping, and the local model always hands unknown prompts to the cloud
+    local = dict(config["local"], confidence_wrong=[0.0, 0.0])
+    sim_backends._config = dict(config, time_scale=0, local=local)
+    server = sim_backends.FakeGeminiServer()
+    base_url = main._CLOUD_CONFIG["base_url"]
+    main._CLOUD_CONFIG["base_url"] = server.start()
+    try:
+        yield TestClient(ai_server.app)
+    finally:
+        main._CLOUD_CONFIG["base_url"] = base_url
+        sim_backends._config = config
+        server.stop()
+
+
+CONTACT = {
+    "id": "c-42", "name": "Ana Ruiz", "role": "ML engineer", "company": "Acme",
+    "skills": ["PyTorch", "MLOps"], "looking_for": ["cofounder"], "domains": ["AI"],
+}
+
+
+def test_cloud_placeholder_numbers_are_numbers(client):
+    result = main.generate_cloud([{"role": "user", "content": "Rate this contact"}], ai_server.RANK_CONTACT_TOOLS)
+    assert isinstance(result["function_calls"][0]["arguments"]["match_score"], (int, float))
+
+
+def test_rank_contact(client):
+    response = client.post("/ai/rank-contact", json={
+        "query_looking_for": "cofounder", "query_domain": "AI", "contact": CONTACT,
+    })
+    assert response.status_code == 200
+    ranking = response.json()
+    assert ranking["contact_id"] == "c-42"
+    assert isinstance(ranking["match_score"], float)
+
+
+def test_health_reports_index_state(client, tmp_path, monkeypatch):
+    indexer = BackgroundIndexer(ProfileIndex())
+    monkeypatch.setattr(ai_server, "_indexer", indexer)
+    assert client.get("/ai/health").json()["rag_available"] is False
+    (tmp_path / "p-1.txt").write_text("Ana Ruiz, ML engineer")
+    indexer.index.load_dir(str(tmp_path))
+    indexer.start()
+    try:
+        health = client.get("/ai/health").json()
+        assert health["rag_available"] is True
+        assert health["rag_generation"] == 1
+    finally:
+        indexer.stop(timeout=5)
+    assert client.get("/ai/health").json()["rag_available"] is False
@@ -0,0 +1,53 @@
+"""Regression cases for the multi-intent splitter in main.py."""
+
+import os
+
+os.environ.setdefault("MINGLE_LOCAL_BACKEND", "sim")
+
+import main  # noqa: E402
+from ai_server import RANK_CONTACT_TOOLS, VOICE_NOTE_TOOLS  # noqa: E402
+from benchmark import BENCHMARKS  # noqa: E402
+
+
+def _user(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_voice_note_prompt_is_not_split():
+    transcript = "Met Sarah at the mixer, she builds robots and wants to meet, then send her the deck"
+    prompt = (
+        f'Process this voice note and help me follow up:\n\n"{transcript}"\n\n'
+        "First, look up the contact mentioned. Then draft a follow-up email."
+    )
+    assert main._split_intents(_user(prompt), VOICE_NOTE_TOOLS) == []
+
+
+def test_rank_prompt_bio_is_not_split():
+    contact_text = (
+        "Name: Ana Ruiz\nRole: Product lead\n"
+        "Bio: I love to build things, find great people and get products shipped.\n"
+        "Skills: product, hiring"
+    )
+    prompt = f"I need a cofounder in AI. Rate this contact: {contact_text}"
+    assert main._split_intents(_user(prompt), RANK_CONTACT_TOOLS) == []
+
+
+def test_conjunction_without_catalog_verb_is_not_split():
+    text = "I love to build things, find great people and get products shipped."
+    assert main._split_intents(_user(text), RANK_CONTACT_TOOLS) == []
+
+
+def test_message_body_is_not_split():
+    tools = [t for case in BENCHMARKS if case["name"] == "message_and_weather" for t in case["tools"]]
+    body = "Text Mom saying I will set the table and get groceries"
+    assert main._split_intents(_user(body), tools) == []
+    assert main._split_intents(_user(body + ", then check the weather in Paris"), tools) == [
+        body, "check the weather in Paris",
+    ]
+
+
+def test_compound_commands_still_split():
+    for case in BENCHMARKS:
+        if case["difficulty"] == "hard":
+            clauses = main._split_intents(case["messages"], case["tools"])
+            assert len(clauses) == len(case["expected_calls"]), case["name"]
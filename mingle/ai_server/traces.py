@@ -0,0 +1,289 @@
+"""
+Record-and-replay traces for routing-policy evaluation.
+
+Recording runs every benchmark case once per tool_rag_top_k setting through the
+local model (with the native confidence gate disabled, so the raw confidence is
+always kept) and once through Gemini, and writes the raw outputs to a gzipped
+JSON-lines file. Compound cases also get each split clause recorded the same
+way. The model passes are recorded for every case whatever MINGLE_FAST_PATH and
+MINGLE_SPLIT_INTENTS say, so one trace serves the live-stage replay below as
+well as tune.py and train_router.py, which replay with both stages off. Replay recomputes generate_hybrid's routing decision for any
+_COMPLEXITY_CONFIG-shaped policy from those traces, with no model inference,
+and scores it with benchmark.compute_total_score. It goes through the same
+stages as the live path: the rule-based fast path and the multi-intent
+splitter run for real (they are cheap and deterministic); only model passes
+come from the recording. A case the live splitter cuts differently from the
+recording cannot be replayed and is skipped. The rule stage's latency is read
+from the trace (measured once at record time), never from the replaying
+process's clock, so replaying one trace under one config always gives the same
+score.
+
+Usage:
+    python traces.py record --out traces.jsonl.gz --top-k 0 1 2 3
+    python traces.py replay traces.jsonl.gz [--config policy.json]
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+import main
+from benchmark import BENCHMARKS, compute_f1, compute_total_score
+
+TRACE_VERSION = 2
+# Rule-stage latency for traces recorded before it was measured
+_FAST_PATH_MS = 0.3
+
+# Fields of the raw cactus_complete response worth keeping
+_LOCAL_FIELDS = (
+    "function_calls", "confidence", "cloud_handoff", "total_time_ms",
+    "time_to_first_token_ms", "decode_tps", "prefill_tokens", "decode_tokens", "validation",
+)
+
+
+def _fast_path_ms(case, clauses):
+    """Wall time of the rule stage on ``case`` (whole turn, then each clause), warm."""
+    def run():
+        main._fast_path(case["messages"], case["tools"])
+        for clause in clauses:
+            main._fast_path(main._clause_messages(clause), case["tools"])
+    run()   # first call compiles the grammars for this tool set
+    start = time.perf_counter()
+    run()
+    return (time.perf_counter() - start) * 1000
+
+
+def record_traces(path, benchmarks=None, top_ks=(0, 1, 2, 3), max_tokens=None):
+    """Run each case per top_k locally and once in the cloud; write the raw outputs to ``path``."""
+    if benchmarks is None:
+        benchmarks = BENCHMARKS
+    if max_tokens is None:
+        max_tokens = max(cfg["max_tokens"] for cfg in main._COMPLEXITY_CONFIG.values())
+
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({
+            "type": "header", "version": TRACE_VERSION, "created": time.time(),
+            "top_ks": list(top_ks), "max_tokens": max_tokens, "local_backend": main.LOCAL_BACKEND,
+        }) + "\n")
+        for i, case in enumerate(benchmarks, 1):
+            print(f"[{i}/{len(benchmarks)}] Recording: {case['name']}...", end=" ", flush=True)
+            # The splitter's clauses even when it is switched off here, so replay can turn it on
+            clauses = main._intent_clauses(case["messages"], case["tools"])
+            if len(clauses) > main._SPLIT_CONFIG["max_clauses"]:
+                clauses = []
+            f.write(json.dumps({
+                "type": "case", "name": case["name"], "difficulty": case["difficulty"],
+                "messages": case["messages"], "tools": case["tools"], "expected_calls": case["expected_calls"],
+                "clauses": clauses, "fast_path_ms": _fast_path_ms(case, clauses),
+            }) + "\n")
+            for top_k in top_ks:
+                cfg = {"max_tokens": max_tokens, "tool_rag_top_k": top_k}
+                raw, _ = main._run_local(case["messages"], case["tools"], cfg, 0.0)
+                f.write(json.dumps({
+                    "type": "local", "name": case["name"], "top_k": top_k,
+                    "raw": {k: raw[k] for k in _LOCAL_FIELDS if k in raw},
+                }) + "\n")
+                for j, clause in enumerate(clauses):
+                    subset = main._clause_tools(clause, case["tools"], main._SPLIT_CONFIG["tools_per_clause"])
+                    raw, _ = main._run_local(main._clause_messages(clause), subset, cfg, 0.0)
+                    f.write(json.dumps({
+                        "type": "clause_local", "name": case["name"], "clause": j, "top_k": top_k,
+                        "raw": {k: raw[k] for k in _LOCAL_FIELDS if k in raw},
+                    }) + "\n")
+            cloud = main.generate_cloud(case["messages"], case["tools"])
+            f.write(json.dumps({
+                "type": "cloud", "name": case["name"],
+                "function_calls": cloud["function_calls"], "total_time_ms": cloud["total_time_ms"],
+            }) + "\n")
+            print("done")
+    return path
+
+
+def load_traces(path):
+    """Return {"header": ..., "cases": {name: {case fields, "local": {top_k: raw}, "cloud": {...}}}}.
+
+    Split cases also carry "clause_local": {clause index: {top_k: raw}}.
+    """
+    header, cases = None, {}
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            rec = json.loads(line)
+            kind = rec.pop("type")
+            if kind == "header":
+                header = rec
+            elif kind == "case":
+                cases[rec["name"]] = dict(rec, local={}, clause_local={}, cloud=None)
+            elif kind == "local":
+                cases[rec["name"]]["local"][rec["top_k"]] = rec["raw"]
+            elif kind == "clause_local":
+                cases[rec["name"]]["clause_local"].setdefault(rec["clause"], {})[rec["top_k"]] = rec["raw"]
+            elif kind == "cloud":
+                cases[rec["name"]]["cloud"] = {"function_calls": rec["function_calls"], "total_time_ms": rec["total_time_ms"]}
+    return {"header": header, "cases": cases}
+
+
+def _gate(raw, threshold, max_tokens):
+    """Apply the native confidence gate and a max_tokens cap to an ungated recording."""
+    raw = dict(raw)
+    if raw.get("confidence", 0) < threshold:
+        # Native handoff returns after prefill with no calls
+        raw["cloud_handoff"] = True
+        raw["function_calls"] = []
+        raw.pop("validation", None)     # validation only runs on returned calls
+        raw["total_time_ms"] = raw.get("time_to_first_token_ms", raw.get("total_time_ms", 0))
+        return raw
+    decode_tokens = raw.get("decode_tokens", 0)
+    decode_tps = raw.get("decode_tps", 0)
+    if decode_tokens > max_tokens and decode_tps > 0:
+        # Truncated before the call closed: no usable calls, decode cut short
+        raw["function_calls"] = []
+        raw.pop("validation", None)
+        raw["total_time_ms"] = raw.get("time_to_first_token_ms", 0) + max_tokens / decode_tps * 1000
+    return raw
+
+
+def _live_stages(case):
+    """The fast-path result and split clauses the live code produces for ``case``.
+
+    Computed once per loaded trace (they do not depend on the routing config)
+    and kept on the case: {"fast": result or None, "clauses": [(clause, fast
+    path hit or None, tool subset)]}.
+    """
+    if "live" not in case:
+        clauses = []
+        for clause in main._split_intents(case["messages"], case["tools"]):
+            hit = main._fast_path(main._clause_messages(clause), case["tools"]) if main._FAST_PATH_ENABLED else None
+            subset = main._clause_tools(clause, case["tools"], main._SPLIT_CONFIG["tools_per_clause"])
+            clauses.append((clause, hit, subset))
+        fast = main._fast_path_result(case["messages"], case["tools"], time.time())
+        case["live"] = {"fast": fast, "clauses": clauses}
+    return case["live"]
+
+
+def routing_stage(case):
+    """Which live stage answers ``case`` first: "fast_path", "split" or "model".
+
+    Only "model" cases reach the learned router and a whole-request local pass.
+    """
+    live = _live_stages(case)
+    if live["fast"] is not None:
+        return "fast_path"
+    return "split" if live["clauses"] else "model"
+
+
+def replayable(case):
+    """False when the live splitter cuts ``case`` into clauses the trace has no recordings for."""
+    clauses = [clause for clause, _, _ in _live_stages(case)["clauses"]]
+    return not clauses or (clauses == case.get("clauses") and len(case.get("clause_local", {})) == len(clauses))
+
+
+def _gated_pass(recorded, config, classify, messages, tools):
+    """The recorded local pass under ``config``. Returns (raw, accepted)."""
+    cfg = config[classify(messages, tools)]
+    raw = _gate(recorded[cfg["tool_rag_top_k"]], main._native_threshold(cfg["confidence_threshold"]), cfg["max_tokens"])
+    return raw, main._accept_local(raw, cfg["confidence_threshold"])
+
+
+def _replay_split(case, config, classify):
+    """Mirror main._run_split from the clause recordings. Returns (calls, local_ms, accepted)."""
+    calls, times, accepted = [], [], True
+    for j, (clause, hit, subset) in enumerate(_live_stages(case)["clauses"]):
+        if hit is not None:
+            calls.append(hit[1])
+            continue
+        raw, ok = _gated_pass(case["clause_local"][j], config, classify, main._clause_messages(clause), subset)
+        calls += raw.get("function_calls", [])
+        times.append(raw.get("total_time_ms", 0))
+        accepted = accepted and ok
+    return main._dedupe_calls(calls), max(times, default=0), accepted     # clauses run in parallel
+
+
+def replay(traces, config=None, hedge=None, classify=None):
+    """Route every traced case under ``config`` and return benchmark-shaped result rows.
+
+    ``config`` maps complexity -> {"tool_rag_top_k", "confidence_threshold", "max_tokens"}
+    (defaults to main._COMPLEXITY_CONFIG); top_k values must have been recorded. ``hedge``
+    defaults to the live hedging switch and applies where the live path would hedge:
+    unsplit requests whose fallback probability reaches the hedge minimum. Cases that are
+    not ``replayable`` are left out of the rows.
+    """
+    config = config or main._COMPLEXITY_CONFIG
+    hedge = main._HEDGE_CONFIG["enabled"] if hedge is None else hedge
+    classify = classify or main._classify_complexity
+    results = []
+    for case in traces["cases"].values():
+        complexity = classify(case["messages"], case["tools"])
+        row = {"name": case["name"], "difficulty": case["difficulty"], "complexity": complexity}
+        stage = routing_stage(case)
+        if stage == "fast_path":
+            fast = _live_stages(case)["fast"]
+            row.update(total_time_ms=case.get("fast_path_ms", _FAST_PATH_MS), source="on-device", fast_path=fast["fast_path"])
+            results.append(dict(row, f1=compute_f1(fast["function_calls"], case["expected_calls"])))
+            continue
+        if not replayable(case):
+            continue
+        if stage == "split":
+            calls, local_ms, accepted = _replay_split(case, config, classify)
+            row["split"] = len(case["clauses"])
+        else:
+            raw, accepted = _gated_pass(case["local"], config, classify, case["messages"], case["tools"])
+            calls, local_ms = raw.get("function_calls", []), raw.get("total_time_ms", 0)
+        if accepted:
+            total_ms, source = local_ms, "on-device"
+        else:
+            cloud = case["cloud"]
+            calls = cloud["function_calls"]
+            hedged = (hedge and stage != "split" and main._fallback_probability(
+                case["messages"], case["tools"], complexity) >= main._HEDGE_CONFIG["min_fallback_prob"])
+            total_ms = max(local_ms, cloud["total_time_ms"]) if hedged else local_ms + cloud["total_time_ms"]
+            source = "cloud (fallback)"
+        results.append(dict(row, total_time_ms=total_ms, f1=compute_f1(calls, case["expected_calls"]), source=source))
+    return results
+
+
+def score_policy(traces, config=None, **kwargs):
+    """Summary metrics for one policy: total score, mean F1, mean latency, on-device ratio.
+
+    ``skipped`` counts the cases replay could not route (see ``replayable``).
+    """
+    results = replay(traces, config, **kwargs)
+    n = len(results)
+    return {
+        "skipped": len(traces["cases"]) - n,
+        "score": compute_total_score(results),
+        "f1": sum(r["f1"] for r in results) / n,
+        "avg_time_ms": sum(r["total_time_ms"] for r in results) / n,
+        "on_device_ratio": sum(1 for r in results if r["source"] == "on-device") / n,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or replay routing traces")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Run the benchmark cases and write a trace file")
+    rec.add_argument("--out", default="traces.jsonl.gz")
+    rec.add_argument("--top-k", type=int, nargs="+", default=[0, 1, 2, 3])
+    rec.add_argument("--max-tokens", type=int, default=None)
+    rep = sub.add_parser("replay", help="Score a routing policy from a trace file")
+    rep.add_argument("path")
+    rep.add_argument("--config", default=None, help="JSON file with a _COMPLEXITY_CONFIG-shaped policy")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_traces(args.out, top_ks=args.top_k, max_tokens=args.max_tokens)
+        print(f"Wrote {args.out}")
+    else:
+        traces = load_traces(args.path)
+        config = None
+        if args.config:
+            with open(args.config) as f:
+                config = json.load(f)
+        start = time.time()
+        summary = score_policy(traces, config)
+        elapsed_ms = (time.time() - start) * 1000
+        print(f"Replayed {len(traces['cases']) - summary['skipped']} cases in {elapsed_ms:.1f}ms")
+        if summary["skipped"]:
+            print(f"  skipped {summary['skipped']} split cases without matching clause recordings (re-record)")
+        print(f"  score={summary['score']:.1f}%  F1={summary['f1']:.2f}  "
+              f"avg time={summary['avg_time_ms']:.0f}ms  on-device={100 * summary['on_device_ratio']:.0f}%")
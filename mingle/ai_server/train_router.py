@@ -0,0 +1,85 @@
+"""
+Train the learned fallback router used by main.generate_hybrid.
+
+Builds one example per traced case that reaches the router (see
+traces.routing_stage): main.router_features for the request, and label 1 when
+the local pass under the given routing config would be rejected or return wrong
+calls (F1 < 1), i.e. when going to the cloud was the right call. The fast path
+and the splitter are off while training (MINGLE_FAST_PATH=0,
+MINGLE_SPLIT_INTENTS=0 unless set explicitly), so every case's recorded model
+pass is used; traces record that pass whatever flags they were recorded with.
+Fits an L2-regularised logistic regression with NumPy and writes w, b and the
+hash dimension to a small .npz that main.py loads at import.
+
+Usage:
+    python train_router.py traces.jsonl.gz [more.jsonl.gz ...] --out router_model.npz
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+# Learn from every case's model pass, not just those the rule stages leave over
+os.environ.setdefault("MINGLE_FAST_PATH", "0")
+os.environ.setdefault("MINGLE_SPLIT_INTENTS", "0")
+
+import main  # noqa: E402
+import traces as trace_store  # noqa: E402
+from benchmark import compute_f1  # noqa: E402
+
+
+def build_dataset(trace_paths, config=None, dim=main._ROUTER_HASH_DIM):
+    config = config or main._COMPLEXITY_CONFIG
+    features, labels = [], []
+    for path in trace_paths:
+        for case in trace_store.load_traces(path)["cases"].values():
+            if trace_store.routing_stage(case) != "model":
+                continue
+            raw, accepted = trace_store._gated_pass(
+                case["local"], config, main._classify_complexity, case["messages"], case["tools"],
+            )
+            local_ok = accepted and compute_f1(raw["function_calls"], case["expected_calls"]) == 1.0
+            features.append(main.router_features(case["messages"], case["tools"], dim))
+            labels.append(0.0 if local_ok else 1.0)
+    if not features:
+        raise ValueError("no traced case reaches the router (all answered by the fast path or split); "
+                         "train with MINGLE_FAST_PATH=0 MINGLE_SPLIT_INTENTS=0")
+    return np.stack(features), np.asarray(labels, dtype=np.float32)
+
+
+def train(X, y, l2=1e-2, lr=0.5, epochs=2000):
+    """Full-batch gradient descent on the regularised log loss."""
+    w = np.zeros(X.shape[1], dtype=np.float32)
+    b = float(np.log((y.mean() + 1e-3) / (1 - y.mean() + 1e-3)))   # start at the base rate
+    n = len(y)
+    for _ in range(epochs):
+        p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+        err = p - y
+        w -= lr * (X.T @ err / n + l2 * w)
+        b -= lr * float(err.mean())
+    return w, b
+
+
+def log_loss(X, y, w, b):
+    p = np.clip(1.0 / (1.0 + np.exp(-(X @ w + b))), 1e-6, 1 - 1e-6)
+    return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the learned fallback router from traces")
+    parser.add_argument("traces", nargs="+", help="Trace files from `python traces.py record`")
+    parser.add_argument("--out", default="router_model.npz")
+    parser.add_argument("--l2", type=float, default=1e-2)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--epochs", type=int, default=2000)
+    args = parser.parse_args()
+
+    X, y = build_dataset(args.traces)
+    w, b = train(X, y, l2=args.l2, lr=args.lr, epochs=args.epochs)
+    p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+    accuracy = float(((p >= 0.5) == (y == 1)).mean())
+    print(f"{len(y)} examples, {int(y.sum())} need cloud")
+    print(f"train log loss={log_loss(X, y, w, b):.3f}  accuracy={accuracy:.2f}")
+    np.savez(args.out, w=w.astype(np.float32), b=np.float32(b), dim=np.int32(main._ROUTER_HASH_DIM))
+    print(f"Wrote {args.out}  (use with MINGLE_ROUTER_MODEL={args.out})")
@@ -0,0 +1,168 @@
+"""
+Tune main._COMPLEXITY_CONFIG against recorded traces.
+
+Searches per-tier confidence_threshold, tool_rag_top_k and max_tokens to maximise
+benchmark.compute_total_score, scoring every candidate by trace replay (see
+traces.py) so no inference runs. Candidates are drawn at random from the grid and
+scored in parallel batches across cores; the search stops once `patience`
+batches in a row fail to improve the best score, or the budget runs out.
+
+Writes the best config (loadable by main.py via MINGLE_ROUTING_CONFIG) and the
+Pareto front over F1 / latency / on-device ratio.
+
+Only cases the routing config can change are scored: a fast-path answer is the
+same under every config. So that every case takes the model path, the tuner
+replays with the fast path and the splitter off (MINGLE_FAST_PATH=0,
+MINGLE_SPLIT_INTENTS=0) unless those are set explicitly; it aborts if no case
+is left to tune on.
+
+Usage:
+    python tune.py traces.jsonl.gz --out tuned_config.json --pareto pareto.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Replay every case through the model path the config controls (see module docstring)
+os.environ.setdefault("MINGLE_FAST_PATH", "0")
+os.environ.setdefault("MINGLE_SPLIT_INTENTS", "0")
+
+import main  # noqa: E402
+import traces as trace_store  # noqa: E402
+
+TIERS = ("easy", "medium", "hard")
+THRESHOLDS = [round(0.50 + 0.02 * i, 2) for i in range(25)]     # 0.50 .. 0.98
+MAX_TOKENS = [64, 96, 128, 192, 256, 320]
+
+_traces = None
+
+
+def _tunable(traces):
+    """The traces minus cases the fast path answers, whose score no config changes."""
+    cases = {name: c for name, c in traces["cases"].items() if trace_store.routing_stage(c) != "fast_path"}
+    return dict(traces, cases=cases)
+
+
+def _init_worker(path):
+    global _traces
+    _traces = _tunable(trace_store.load_traces(path))
+
+
+def _evaluate(config):
+    return config, trace_store.score_policy(_traces, config)
+
+
+def _grid(recorded_top_ks, recorded_max_tokens):
+    """All per-tier settings the traces can answer for."""
+    return [
+        {"confidence_threshold": t, "tool_rag_top_k": k, "max_tokens": m}
+        for t, k, m in itertools.product(
+            THRESHOLDS, recorded_top_ks, [m for m in MAX_TOKENS if m <= recorded_max_tokens],
+        )
+    ]
+
+
+def _dominates(a, b):
+    """a is at least as good as b on every objective and strictly better on one."""
+    ge = (a["f1"] >= b["f1"], a["avg_time_ms"] <= b["avg_time_ms"], a["on_device_ratio"] >= b["on_device_ratio"])
+    gt = (a["f1"] > b["f1"], a["avg_time_ms"] < b["avg_time_ms"], a["on_device_ratio"] > b["on_device_ratio"])
+    return all(ge) and any(gt)
+
+
+def _ties(a, b):
+    return (a["f1"], a["avg_time_ms"], a["on_device_ratio"]) == (b["f1"], b["avg_time_ms"], b["on_device_ratio"])
+
+
+def pareto_front(evaluated):
+    """Non-dominated (config, metrics) pairs, best score first.
+
+    Configs that tie on every objective (e.g. differing only in a tier no case
+    falls in) are one point; the first evaluated is kept.
+    """
+    front = []
+    for config, metrics in evaluated:
+        if any(_dominates(other, metrics) or _ties(other, metrics) for _, other in front):
+            continue
+        front = [(c, m) for c, m in front if not _dominates(metrics, m)]
+        front.append((config, metrics))
+    return sorted(front, key=lambda cm: cm[1]["score"], reverse=True)
+
+
+def tune(trace_path, budget=20000, batch_size=512, patience=8, workers=None, seed=0):
+    """Random search over the per-tier grid with early stopping. Returns (best, front, evaluated count)."""
+    workers = workers or os.cpu_count() or 1
+    traces = _tunable(trace_store.load_traces(trace_path))
+    if not traces["cases"]:
+        raise ValueError("no traced case depends on the routing config (the fast path answers all of "
+                         "them); tune with MINGLE_FAST_PATH=0 MINGLE_SPLIT_INTENTS=0")
+    header = traces["header"]
+    grid = _grid(header["top_ks"], header["max_tokens"])
+    rng = random.Random(seed)
+
+    # Always score the current hand-picked config first as the baseline
+    baseline = {tier: dict(main._COMPLEXITY_CONFIG[tier]) for tier in TIERS}
+    seen = set()
+    evaluated = []
+    best = (baseline, trace_store.score_policy(traces, baseline))
+    evaluated.append(best)
+    seen.add(json.dumps(baseline, sort_keys=True))
+
+    stale = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(trace_path,)) as pool:
+        while len(evaluated) < budget and stale < patience:
+            batch = []
+            attempts = 0
+            while len(batch) < batch_size and attempts < batch_size * 10:
+                attempts += 1
+                config = {tier: rng.choice(grid) for tier in TIERS}
+                key = json.dumps(config, sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    batch.append(config)
+            if not batch:
+                break   # grid exhausted
+            improved = False
+            for config, metrics in pool.map(_evaluate, batch, chunksize=max(1, len(batch) // (4 * workers))):
+                evaluated.append((config, metrics))
+                if metrics["score"] > best[1]["score"]:
+                    best = (config, metrics)
+                    improved = True
+            stale = 0 if improved else stale + 1
+    return best, pareto_front(evaluated), len(evaluated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune routing thresholds from recorded traces")
+    parser.add_argument("traces", help="Trace file from `python traces.py record`")
+    parser.add_argument("--budget", type=int, default=20000, help="Max configs to evaluate")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--patience", type=int, default=8, help="Stop after this many batches without improvement")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="tuned_config.json")
+    parser.add_argument("--pareto", default="pareto.json")
+    args = parser.parse_args()
+
+    start = time.time()
+    (best_config, best_metrics), front, n = tune(
+        args.traces, budget=args.budget, batch_size=args.batch_size,
+        patience=args.patience, workers=args.workers, seed=args.seed,
+    )
+    print(f"Evaluated {n} configs in {time.time() - start:.1f}s")
+    print(f"Best score={best_metrics['score']:.1f}%  F1={best_metrics['f1']:.2f}  "
+          f"avg time={best_metrics['avg_time_ms']:.0f}ms  on-device={100 * best_metrics['on_device_ratio']:.0f}%")
+    for tier in TIERS:
+        print(f"  {tier:<7} {best_config[tier]}")
+
+    with open(args.out, "w") as f:
+        json.dump(best_config, f, indent=2)
+    with open(args.pareto, "w") as f:
+        json.dump([{"config": c, "metrics": m} for c, m in front], f, indent=2)
+    print(f"Wrote {args.out} ({len(front)} Pareto-optimal configs in {args.pareto})")
+    print(f"Use it with: MINGLE_ROUTING_CONFIG={args.out}")
@@ -19,6 +19,32 @@ router.post("/rank", async (req, res) => {
   }
 });
 
+// POST /api/outreach/rank/stream  — proxies to FastAPI /ai/rank-contacts/stream
+// Pipes the NDJSON through unbuffered so the first matches render right away.
+router.post("/rank/stream", async (req, res) => {
+  const controller = new AbortController();
+  // Stop the upstream ranking if the browser goes away mid-stream
+  res.on("close", () => controller.abort());
+  try {
+    const response = await axios.post(`${AI_SERVER}/ai/rank-contacts/stream`, req.body, {
+      timeout: 60000,
+      responseType: "stream",
+      signal: controller.signal,
+    });
+    res.status(200);
+    res.setHeader("Content-Type", "application/x-ndjson");
+    res.setHeader("Cache-Control", "no-cache");
+    res.setHeader("X-Accel-Buffering", "no");
+    res.flushHeaders();
+    response.data.on("error", () => res.end());
+    response.data.pipe(res);
+  } catch (err) {
+    if (controller.signal.aborted) return;
+    const status = err.response?.status || 502;
+    res.status(status).json({ error: err.message });
+  }
+});
+
 // POST /api/outreach/draft  — proxies to FastAPI /ai/draft-outreach
 router.post("/draft", async (req, res) => {
   try {
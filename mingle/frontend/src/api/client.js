@@ -22,5 +22,41 @@ export const removeContact = (userId, profileId) =>
 // ---- Outreach ----
 export const rankContacts = (payload) =>
   api.post("/outreach/rank", payload).then((r) => r.data);
+
+// Streams rankings as they finish: onEvent gets each NDJSON event ("ranking",
+// then one "summary"); resolves with the summary. Pass an AbortSignal to cancel.
+export async function rankContactsStream(payload, onEvent, { signal } = {}) {
+  const response = await fetch("/api/outreach/rank/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+    signal,
+  });
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}));
+    throw new Error(body.error || `Ranking failed (${response.status})`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let summary = null;
+  const emit = (line) => {
+    if (!line.trim()) return;
+    const event = JSON.parse(line);
+    if (event.type === "summary") summary = event;
+    onEvent?.(event);
+  };
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.forEach(emit);
+  }
+  emit(buffer + decoder.decode());
+  return summary;
+}
+
 export const draftOutreach = (payload) =>
   api.post("/outreach/draft", payload).then((r) => r.data);